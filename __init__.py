@@ -5,3 +5,4 @@ Expose the domain_draw API
 """
 
 from .draw_domains import schematic
+from .store import domain_store
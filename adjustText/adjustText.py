@@ -1,6 +1,8 @@
 
 import sys
 from matplotlib import pyplot as plt
+from matplotlib.text import Text
+from matplotlib.transforms import Bbox
 from itertools import product
 import numpy as np
 from operator import itemgetter
@@ -14,12 +16,110 @@ def get_text_position(text, ax=None):
     return (ax.xaxis.convert_units(x),
             ax.yaxis.convert_units(y))
 
+# Text extents relative to the text's anchor point, in display units.
+# Labels repeat a lot, and this lives for the whole process, so it is shared by
+# every figure drawn in it.
+_extent_cache = {}
+EXTENT_CACHE_SIZE = 100000
+
+def _extent_key(text, r):
+    fp = text.get_fontproperties()
+    return (type(r), text.figure.dpi, text.get_text(),
+            tuple(fp.get_family()), fp.get_style(), fp.get_variant(),
+            fp.get_weight(), fp.get_stretch(), fp.get_size_in_points(),
+            fp.get_file(), fp.get_math_fontfamily(),
+            text.get_rotation(), text.get_rotation_mode(),
+            text.get_ha(), text.get_va(),
+            getattr(text, "_multialignment", None),
+            getattr(text, "_linespacing", None), text.get_usetex())
+
+def get_text_extent(obj, r):
+    """
+    As obj.get_window_extent(r), but for Text objects the size and offset
+    of the extent are cached, keyed by string, font properties, alignment
+    and DPI, so only the position needs transforming.
+    Only plain Text: the extent of an Annotation includes its arrow, and its
+    position comes from xyann/anncoords, so subclasses are measured in full.
+    Wrapped text is too, as where it wraps depends on where it is in the figure.
+    """
+    if (type(obj) is not Text or obj.get_wrap() or not obj.get_visible() or
+            obj.get_text() == '' or obj.figure is None):
+        return obj.get_window_extent(r)
+    key = _extent_key(obj, r)
+    offset = _extent_cache.get(key)
+    if offset is None:
+        if len(_extent_cache) >= EXTENT_CACHE_SIZE:
+            _extent_cache.clear()
+        x, y = obj.get_transform().transform(obj.get_unitless_position())
+        offset = obj.get_window_extent(r).get_points() - (x, y)
+        _extent_cache[key] = offset
+        return Bbox(offset + (x, y))
+    x, y = obj.get_transform().transform(obj.get_unitless_position())
+    return Bbox(offset + (x, y))
+
 def get_bboxes(objs, r, expand=(1.0, 1.0), ax=None):
     if ax is None:
         ax = plt.gca()
-    return [i.get_window_extent(r).expanded(*expand).transformed(ax.\
+    return [get_text_extent(i, r).expanded(*expand).transformed(ax.\
                                           transData.inverted()) for i in objs]
 
+def get_bbox_points(bboxes):
+    """
+    The corners of the bboxes as one (n, 2, 2) array, [[x0, y0], [x1, y1]]
+    per bbox. An array of corners is passed through as it is.
+    """
+    if isinstance(bboxes, np.ndarray):
+        return bboxes
+    if len(bboxes) == 0:
+        return np.zeros((0, 2, 2))
+    return np.array([bbox.get_points() for bbox in bboxes])
+
+def expand_bbox_points(points, expand):
+    """
+    As Bbox.expanded(*expand) on each bbox in a get_bbox_points() array.
+    """
+    size = points[:, 1] - points[:, 0]
+    delta = (size*np.asarray(expand) - size)/2
+    return points + np.stack([-delta, delta], axis=1)
+
+def get_bbox_extents(bboxes):
+    """
+    The bboxes as arrays: (x0, y0, xmin, ymin, xmax, ymax), one entry per bbox.
+    x0, y0 are the first corner as stored, which can differ from xmin, ymin
+    on inverted axes. bboxes can be Bbox objects or a get_bbox_points() array.
+    """
+    points = get_bbox_points(bboxes)
+    return (points[:, 0, 0], points[:, 0, 1],
+            points[:, :, 0].min(axis=1), points[:, :, 1].min(axis=1),
+            points[:, :, 0].max(axis=1), points[:, :, 1].max(axis=1))
+
+def get_x_candidates(amins, amaxs, bmins, bmaxs):
+    """
+    Sweep-line candidate pairs: every (i, j) of box i in a and box j in b
+    whose closed x-intervals overlap. b is sorted by xmin once, and each
+    box in a only looks at the run of b that can reach it, so on a linear
+    track this is O(n log n) plus the number of overlaps, not O(n*m).
+    Returns (i, j) index arrays, ordered by i, then j.
+    """
+    if len(amins) == 0 or len(bmins) == 0:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty
+    order = np.argsort(bmins, kind='stable')
+    sorted_mins = bmins[order]
+    widest = np.max(bmaxs - bmins)
+    # b can only reach back as far as its widest box; pad for rounding
+    reach = amins - widest - 1e-9*(np.abs(amins) + widest)
+    lo = np.searchsorted(sorted_mins, reach, 'left')
+    hi = np.searchsorted(sorted_mins, amaxs, 'right')
+    counts = np.maximum(hi - lo, 0)
+    i = np.repeat(np.arange(len(amins)), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    j = order[np.arange(counts.sum()) + starts]
+    keep = (bmins[j] <= amaxs[i]) & (bmaxs[j] >= amins[i])
+    i, j = i[keep], j[keep]
+    by_index = np.lexsort((j, i))
+    return i[by_index], j[by_index]
+
 def get_midpoint(bbox):
     cx = (bbox.x0+bbox.x1)/2
     cy = (bbox.y0+bbox.y1)/2
@@ -59,6 +159,11 @@ def overlap_bbox_and_point(bbox, xp, yp):
     return dx, dy
 
 def move_texts(texts, delta_x, delta_y, bboxes=None, renderer=None, ax=None):
+    """
+    Move the texts by delta_x, delta_y, except along an axis where that
+    would take them out of the axes. bboxes can be Bbox objects or a
+    get_bbox_points() array. Returns the moves that were made, as arrays.
+    """
     if ax is None:
         ax = plt.gca()
     if bboxes is None:
@@ -69,9 +174,11 @@ def move_texts(texts, delta_x, delta_y, bboxes=None, renderer=None, ax=None):
         bboxes = get_bboxes(texts, r, (1, 1), ax=ax)
     xmin, xmax = ax.get_xlim()
     ymin, ymax = ax.get_ylim()
+    x1s, y1s, x2s, y2s = get_bbox_extents(bboxes)[2:]
+    moved_x = np.zeros(len(texts))
+    moved_y = np.zeros(len(texts))
     for i, (text, dx, dy) in enumerate(zip(texts, delta_x, delta_y)):
-        bbox = bboxes[i]
-        x1, y1, x2, y2 = bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax
+        x1, y1, x2, y2 = x1s[i], y1s[i], x2s[i], y2s[i]
         if x1 + dx < xmin:
             dx = 0
         if x2 + dx > xmax:
@@ -85,6 +192,8 @@ def move_texts(texts, delta_x, delta_y, bboxes=None, renderer=None, ax=None):
         newx = x + dx
         newy = y + dy
         text.set_position((newx, newy))
+        moved_x[i], moved_y[i] = dx, dy
+    return moved_x, moved_y
 
 def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
                          renderer=None, ax=None,
@@ -102,6 +211,7 @@ def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
     xmin, xmax = ax.get_xlim()
     ymin, ymax = ax.get_ylim()
     bboxes = get_bboxes(texts, r, expand, ax=ax)
+    extents = np.array(get_bbox_extents(bboxes+add_bboxes)[2:])
     if 'x' not in direction:
         ha = ['']
     else:
@@ -122,15 +232,18 @@ def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
                 text.set_ha(h)
             if v:
                 text.set_va(v)
-            bbox = text.get_window_extent(r).expanded(*expand).\
+            bbox = get_text_extent(text, r).expanded(*expand).\
                                        transformed(ax.transData.inverted())
             c = len(get_points_inside_bbox(x, y, bbox))
-            intersections = [bbox.intersection(bbox, bbox2) for bbox2 in
-                             bboxes+add_bboxes]
-            intersections = sum([abs(b.width*b.height) if b is not None else 0
-                                 for b in intersections])
+            # Areas of the intersections with all of the bboxes at once
+            ix = (np.minimum(bbox.xmax, extents[2]) -
+                  np.maximum(bbox.xmin, extents[0]))
+            iy = (np.minimum(bbox.ymax, extents[3]) -
+                  np.maximum(bbox.ymin, extents[1]))
+            areas = np.where((ix >= 0) & (iy >= 0), np.abs(ix*iy), 0)
+            intersections = sum(areas.tolist())
             # Check for out-of-axes position
-            bbox = text.get_window_extent(r).transformed(ax.transData.inverted())
+            bbox = get_text_extent(text, r).transformed(ax.transData.inverted())
             x1, y1, x2, y2 = bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax
             if x1 < xmin or x2 > xmax or y1 < ymin or y2 > ymax:
                 axout = 1
@@ -142,18 +255,22 @@ def optimally_align_text(x, y, texts, expand=(1., 1.), add_bboxes=[],
             text.set_ha(alignment[a][0])
         if 'y' in direction:
             text.set_va(alignment[a][1])
-        bboxes[i] = text.get_window_extent(r).expanded(*expand).\
+        bboxes[i] = get_text_extent(text, r).expanded(*expand).\
                                        transformed(ax.transData.inverted())
+        extents[:, i] = (bboxes[i].xmin, bboxes[i].ymin,
+                         bboxes[i].xmax, bboxes[i].ymax)
     return texts
 
 def repel_text(texts, renderer=None, ax=None, expand=(1.2, 1.2),
-               only_use_max_min=False, move=False):
+               only_use_max_min=False, move=False, bboxes=None):
     """
     Repel texts from each other while expanding their bounding boxes by expand
     (x, y), e.g. (1.2, 1.2) would multiply width and height by 1.2.
     Requires a renderer to get the actual sizes of the text, and to that end
     either one needs to be directly provided, or the axes have to be specified,
     and the renderer is then got from the axes object.
+    bboxes can give the (already expanded) bboxes of the texts, in data
+    coordinates, instead of measuring them.
     """
     if ax is None:
         ax = plt.gca()
@@ -161,34 +278,27 @@ def repel_text(texts, renderer=None, ax=None, expand=(1.2, 1.2),
         r = get_renderer(ax.get_figure())
     else:
         r = renderer
-    bboxes = get_bboxes(texts, r, expand, ax=ax)
-    xmins = [bbox.xmin for bbox in bboxes]
-    xmaxs = [bbox.xmax for bbox in bboxes]
-    ymaxs = [bbox.ymax for bbox in bboxes]
-    ymins = [bbox.ymin for bbox in bboxes]
-
-    overlaps_x = np.zeros((len(bboxes), len(bboxes)))
-    overlaps_y = np.zeros_like(overlaps_x)
-    overlap_directions_x = np.zeros_like(overlaps_x)
-    overlap_directions_y = np.zeros_like(overlaps_y)
-    for i, bbox1 in enumerate(bboxes):
-        overlaps = get_points_inside_bbox(xmins*2+xmaxs*2, (ymins+ymaxs)*2,
-                                             bbox1) % len(bboxes)
-        overlaps = np.unique(overlaps)
-        for j in overlaps:
-            bbox2 = bboxes[j]
-            x, y = bbox1.intersection(bbox1, bbox2).size
-            overlaps_x[i, j] = x
-            overlaps_y[i, j] = y
-            direction = np.sign(bbox1.extents - bbox2.extents)[:2]
-            overlap_directions_x[i, j] = direction[0]
-            overlap_directions_y[i, j] = direction[1]
-
-    move_x = overlaps_x*overlap_directions_x
-    move_y = overlaps_y*overlap_directions_y
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
+    if bboxes is None:
+        bboxes = get_bboxes(texts, r, expand, ax=ax)
+    x0, y0, xmins, ymins, xmaxs, ymaxs = get_bbox_extents(bboxes)
+
+    # Only pairs whose x-extents overlap can collide.
+    # j overlaps i when one of the corners of j is strictly inside i.
+    i, j = get_x_candidates(xmins, xmaxs, xmins, xmaxs)
+    def inside(v, vmins, vmaxs):
+        return (v[j] > vmins[i]) & (v[j] < vmaxs[i])
+    overlaps = ((inside(xmins, xmins, xmaxs) | inside(xmaxs, xmins, xmaxs)) &
+                (inside(ymins, ymins, ymaxs) | inside(ymaxs, ymins, ymaxs)))
+    i, j = i[overlaps], j[overlaps]
+
+    # Size of the intersection, times the direction to move i away from j
+    move_x = ((np.minimum(xmaxs[i], xmaxs[j]) - np.maximum(xmins[i], xmins[j])) *
+              np.sign(x0[i] - x0[j]))
+    move_y = ((np.minimum(ymaxs[i], ymaxs[j]) - np.maximum(ymins[i], ymins[j])) *
+              np.sign(y0[i] - y0[j]))
+
+    delta_x = np.bincount(i, weights=move_x, minlength=len(bboxes))
+    delta_y = np.bincount(i, weights=move_y, minlength=len(bboxes))
 
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
@@ -197,7 +307,7 @@ def repel_text(texts, renderer=None, ax=None, expand=(1.2, 1.2),
 
 def repel_text_from_bboxes(add_bboxes, texts, renderer=None, ax=None,
                            expand=(1.2, 1.2), only_use_max_min=False,
-                           move=False):
+                           move=False, bboxes=None):
     """
     Repel texts from other objects' bboxes while expanding their (texts')
     bounding boxes by expand (x, y), e.g. (1.2, 1.2) would multiply width and
@@ -205,6 +315,8 @@ def repel_text_from_bboxes(add_bboxes, texts, renderer=None, ax=None,
     Requires a renderer to get the actual sizes of the text, and to that end
     either one needs to be directly provided, or the axes have to be specified,
     and the renderer is then got from the axes object.
+    bboxes can give the (already expanded) bboxes of the texts, as in
+    repel_text().
     """
     if ax is None:
         ax = plt.gca()
@@ -213,30 +325,23 @@ def repel_text_from_bboxes(add_bboxes, texts, renderer=None, ax=None,
     else:
         r = renderer
 
-    bboxes = get_bboxes(texts, r, expand, ax=ax)
+    if bboxes is None:
+        bboxes = get_bboxes(texts, r, expand, ax=ax)
+    x0, y0, xmins, ymins, xmaxs, ymaxs = get_bbox_extents(bboxes)
+    ox0, oy0, oxmins, oymins, oxmaxs, oymaxs = get_bbox_extents(add_bboxes)
+
+    # Any intersection counts, even one of zero width or height
+    i, j = get_x_candidates(xmins, xmaxs, oxmins, oxmaxs)
+    size_x = np.minimum(xmaxs[i], oxmaxs[j]) - np.maximum(xmins[i], oxmins[j])
+    size_y = np.minimum(ymaxs[i], oymaxs[j]) - np.maximum(ymins[i], oymins[j])
+    overlaps = (size_x >= 0) & (size_y >= 0)
+    i, j = i[overlaps], j[overlaps]
+
+    move_x = size_x[overlaps]*np.sign(x0[i] - ox0[j])
+    move_y = size_y[overlaps]*np.sign(y0[i] - oy0[j])
 
-    overlaps_x = np.zeros((len(bboxes), len(add_bboxes)))
-    overlaps_y = np.zeros_like(overlaps_x)
-    overlap_directions_x = np.zeros_like(overlaps_x)
-    overlap_directions_y = np.zeros_like(overlaps_y)
-
-    for i, bbox1 in enumerate(bboxes):
-        for j, bbox2 in enumerate(add_bboxes):
-            try:
-                x, y = bbox1.intersection(bbox1, bbox2).size
-                direction = np.sign(bbox1.extents - bbox2.extents)[:2]
-                overlaps_x[i, j] = x
-                overlaps_y[i, j] = y
-                overlap_directions_x[i, j] = direction[0]
-                overlap_directions_y[i, j] = direction[1]
-            except AttributeError:
-                pass
-
-    move_x = overlaps_x*overlap_directions_x
-    move_y = overlaps_y*overlap_directions_y
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
+    delta_x = np.bincount(i, weights=move_x, minlength=len(bboxes))
+    delta_y = np.bincount(i, weights=move_y, minlength=len(bboxes))
 
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
@@ -244,7 +349,7 @@ def repel_text_from_bboxes(add_bboxes, texts, renderer=None, ax=None,
     return delta_x, delta_y, q
 
 def repel_text_from_points(x, y, texts, renderer=None, ax=None,
-                           expand=(1.2, 1.2), move=False):
+                           expand=(1.2, 1.2), move=False, bboxes=None):
     """
     Repel texts from all points specified by x and y while expanding their
     (texts'!) bounding boxes by expandby  (x, y), e.g. (1.2, 1.2)
@@ -252,6 +357,8 @@ def repel_text_from_points(x, y, texts, renderer=None, ax=None,
     Requires a renderer to get the actual sizes of the text, and to that end
     either one needs to be directly provided, or the axes have to be specified,
     and the renderer is then got from the axes object.
+    bboxes can give the (already expanded) bboxes of the texts, as in
+    repel_text().
     """
     assert len(x) == len(y)
     if ax is None:
@@ -260,21 +367,30 @@ def repel_text_from_points(x, y, texts, renderer=None, ax=None,
         r = get_renderer(ax.get_figure())
     else:
         r = renderer
-    bboxes = get_bboxes(texts, r, expand, ax=ax)
-
-    move_x = np.zeros((len(bboxes), len(x)))
-    move_y = np.zeros((len(bboxes), len(x)))
-    for i, bbox in enumerate(bboxes):
-        xy_in = get_points_inside_bbox(x, y, bbox)
-        for j in xy_in:
-            xp, yp = x[j], y[j]
-            dx, dy = overlap_bbox_and_point(bbox, xp, yp)
-
-            move_x[i, j] = dx
-            move_y[i, j] = dy
-
-    delta_x = move_x.sum(axis=1)
-    delta_y = move_y.sum(axis=1)
+    if bboxes is None:
+        bboxes = get_bboxes(texts, r, expand, ax=ax)
+    bx0, by0, xmins, ymins, xmaxs, ymaxs = get_bbox_extents(bboxes)
+    points = get_bbox_points(bboxes)
+    bx1, by1 = points[:, 1, 0], points[:, 1, 1]
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Points strictly inside each bbox, see get_points_inside_bbox()
+    i, j = get_x_candidates(xmins, xmaxs, x, x)
+    inside = ((x[j] > xmins[i]) & (x[j] < xmaxs[i]) &
+              (y[j] > ymins[i]) & (y[j] < ymaxs[i]))
+    i, j = i[inside], j[inside]
+
+    # As overlap_bbox_and_point(): push the bbox off the point, away from its middle
+    dir_x = np.sign((bx0[i] + bx1[i])/2 - x[j])
+    dir_y = np.sign((by0[i] + by1[i])/2 - y[j])
+    move_x = np.select([dir_x == -1, dir_x == 1],
+                       [x[j] - xmaxs[i], x[j] - xmins[i]], 0)
+    move_y = np.select([dir_y == -1, dir_y == 1],
+                       [y[j] - ymaxs[i], y[j] - ymins[i]], 0)
+
+    delta_x = np.bincount(i, weights=move_x, minlength=len(bboxes))
+    delta_y = np.bincount(i, weights=move_y, minlength=len(bboxes))
     q = np.sum(np.abs(delta_x) + np.abs(delta_y))
     if move:
         move_texts(texts, delta_x, delta_y, bboxes, ax=ax)
@@ -452,20 +568,29 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
         ax.draw(r)
 
     texts = repel_text_from_axes(texts, ax, renderer=r, expand=expand_points)
+
+    # From here on the texts are only moved, so on linear axes their bboxes are
+    # measured once and moved along with them, instead of asking the renderer
+    # for every text on every iteration.
+    linear = ax.get_xscale() == 'linear' and ax.get_yscale() == 'linear'
+    bboxes = get_bbox_points(get_bboxes(texts, r, (1, 1), ax=ax))
+    add_bboxes = get_bbox_points(add_bboxes)
     history = [np.inf]*5
     for i in range(lim):
         q1, q2 = np.inf, np.inf
+        if not linear:
+            bboxes = get_bbox_points(get_bboxes(texts, r, (1, 1), ax=ax))
 
         if text_from_text:
             d_x_text, d_y_text, q1 = repel_text(texts, renderer=r, ax=ax,
-                                                expand=expand_text)
+                                    bboxes=expand_bbox_points(bboxes, expand_text))
         else:
             d_x_text, d_y_text, q1 = [0]*len(texts), [0]*len(texts), 0
 
         if text_from_points:
             d_x_points, d_y_points, q2 = repel_text_from_points(x, y, texts,
                                                    ax=ax, renderer=r,
-                                                   expand=expand_points)
+                                  bboxes=expand_bbox_points(bboxes, expand_points))
         else:
             d_x_points, d_y_points, q2 = [0]*len(texts), [0]*len(texts), 0
 
@@ -473,7 +598,7 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
             d_x_objects, d_y_objects, q3 = repel_text_from_bboxes(add_bboxes,
                                                                   texts,
                                                              ax=ax, renderer=r,
-                                                         expand=expand_objects)
+                                 bboxes=expand_bbox_points(bboxes, expand_objects))
         else:
             d_x_objects, d_y_objects, q3 = [0]*len(texts), [0]*len(texts), 0
 
@@ -503,8 +628,8 @@ def adjust_text(texts, x=None, y=None, add_objects=None, ax=None,
         if q > precision and q < np.max(history):
             history.pop(0)
             history.append(q)
-            move_texts(texts, dx, dy,
-                       bboxes = get_bboxes(texts, r, (1, 1)), ax=ax)
+            moved_x, moved_y = move_texts(texts, dx, dy, bboxes=bboxes, ax=ax)
+            bboxes = bboxes + np.stack([moved_x, moved_y], axis=1)[:, None, :]
             if save_steps:
                 if add_step_numbers:
                     plt.title(i+1)
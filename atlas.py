@@ -0,0 +1,111 @@
+"""
+
+Pack thumbnails into large sheet images (sprite sheets), with a JSON index
+
+Each sheet is a grid of equally sized tiles, filled row by row. The index
+maps each item name to the sheet and pixel rectangle that holds it:
+
+    {"tile": [<width>, <height>], "columns": ..., "rows": ...,
+    "sheets": ["atlas_0000.png", ...],
+    "items": {<name>: [<sheet number>, <x>, <y>, <width>, <height>], ...}}
+
+x and y are the top left corner of the tile, in pixels from the top left of the sheet.
+
+"""
+
+import os, json
+
+import numpy
+
+from .raster import png_encode
+
+class atlas_writer:
+    def __init__(self, path, columns=32, rows=64, prefix="atlas"):
+        """
+        **Purpose**
+            Write tiles into <path>/<prefix>_0000.png, <prefix>_0001.png ...
+            and the index to <path>/<prefix>.json
+
+        **Arguments**
+            path
+                directory to save the sheets and index in
+
+            columns, rows (Optional, default=32, 64)
+                number of tiles across and down each sheet
+
+            prefix (Optional, default="atlas")
+                start of the sheet and index filenames
+        """
+        assert columns > 0 and rows > 0, 'atlas_writer needs at least one column and row'
+        self.path = path
+        self.columns = columns
+        self.rows = rows
+        self.prefix = prefix
+
+        self.tile = None # (width, height), set by the first tile
+        self.sheet = None
+        self.used = 0 # tiles in the current sheet
+        self.sheets = []
+        self.items = {}
+
+    def add(self, name, pixels):
+        """
+        **Purpose**
+            Paste a (height, width, 4) uint8 RGBA tile into the next free slot
+
+        **Returns**
+            The [<sheet number>, <x>, <y>, <width>, <height>] index entry for name
+        """
+        height, width = pixels.shape[:2]
+        if self.tile is None:
+            self.tile = (width, height)
+        assert (width, height) == self.tile, 'atlas tiles must all be {0}x{1} pixels, not {2}x{3}'.format(self.tile[0], self.tile[1], width, height)
+        if name in self.items:
+            print("Warning: '%s' is already in the atlas, replacing it" % name)
+
+        if self.sheet is None:
+            self.sheet = numpy.full((self.rows * height, self.columns * width, 4), 255, dtype=numpy.uint8)
+            self.used = 0
+
+        y, x = divmod(self.used, self.columns)
+        x *= width
+        y *= height
+        self.sheet[y:y+height, x:x+width] = pixels
+        self.items[name] = [len(self.sheets), x, y, width, height]
+        self.used += 1
+
+        if self.used == self.columns * self.rows:
+            self.__flush()
+        return self.items[name]
+
+    def __flush(self):
+        if self.sheet is None:
+            return
+        # Trim the unused rows of a part filled sheet
+        used_rows = (self.used + self.columns - 1) // self.columns
+        filename = "%s_%04d.png" % (self.prefix, len(self.sheets))
+        with open(os.path.join(self.path, filename), 'wb') as oh:
+            oh.write(png_encode(self.sheet[:used_rows * self.tile[1]]))
+        self.sheets.append(filename)
+        self.sheet = None
+
+    def close(self):
+        """
+        **Purpose**
+            Save the last sheet and the index
+
+        **Returns**
+            The filename of the index
+        """
+        self.__flush()
+        filename = os.path.join(self.path, "%s.json" % self.prefix)
+        with open(filename, 'wt') as oh:
+            json.dump({"tile": list(self.tile or (0, 0)), "columns": self.columns, "rows": self.rows,
+                "sheets": self.sheets, "items": self.items}, oh)
+        return filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,109 @@
+"""
+
+Benchmark the 'dfam' loader against a plain line by line parser
+
+    python -m domain_draw.bench_dfam [<Dfam .hits file>]
+
+Without a filename, a synthetic table (40,000 sequences, about 15 MB) is written
+to a temporary file and used. Each loader is run a few times, and the best time
+is reported as MB/s of input, along with the speed up over the line by line parser.
+The line by line parser makes exactly the records that parse_file(format='dfam') does,
+and the output of each loader is checked against it.
+
+"""
+
+import os, sys, time, random, tempfile
+
+from .draw_domains import schematic
+
+HEADER = "#seq_name\tfamily_acc\tfamily_name\tbits\te-value\tbias\thmm-st\thmm-en\tstrand\tali-st\tali-en\tenv-st\tenv-en\tsq-len\tkimura_div\n"
+
+def write_synthetic(filename, sequences=40000, seed=1):
+    """
+    **Purpose**
+        Write a synthetic Dfam .hits table, with 1-8 hits per sequence
+    """
+    rng = random.Random(seed)
+    families = [("DF%07d" % i, name) for i, name in enumerate(["MIR", "AluY", "L1M", "L2", "MER5A", "THE1B", "Charlie1", "Tigger1"] * 25)]
+    with open(filename, 'wt') as oh:
+        oh.write(HEADER)
+        for i in range(sequences):
+            seq_len = rng.randint(1000, 200000)
+            for h in range(rng.randint(1, 8)):
+                acc, name = rng.choice(families)
+                st = rng.randint(1, seq_len - 500)
+                en = st + rng.randint(30, 499)
+                strand = rng.choice("+-")
+                if strand == "-":
+                    st, en = en, st
+                oh.write("chr{0}_{1}\t{2}\t{3}\t{4:.1f}\t1e-20\t0.1\t1\t100\t{5}\t{6}\t{7}\t{6}\t{7}\t{8}\t12.3\n".format(
+                    i // 1000, i, acc, name, rng.uniform(20, 100), strand, st, en, seq_len))
+
+def load_line_by_line(filename):
+    """
+    **Purpose**
+        The reference: split one line at a time, and build the records as it goes
+    """
+    items = {}
+    with open(filename, 'rt') as oh:
+        for line in oh:
+            if line[0] == "#" or line.isspace():
+                continue
+            t = line.split("\t")
+            ali_st = int(t[9])
+            ali_en = int(t[10])
+            d = {"name": t[2], "pos": (min(ali_st, ali_en) - 1, max(ali_st, ali_en) - 1), "db": t[1]}
+            if t[0] not in items:
+                items[t[0]] = {"name": t[0], "type": "", "domains": [], "len": int(t[13])}
+            items[t[0]]["domains"].append(d)
+    return list(items.values())
+
+def best_time(func, repeats=3):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run(filename, repeats=3):
+    """
+    **Purpose**
+        Time the loaders on filename, and print a table of the results
+
+    **Returns**
+        A dict of {<loader>: <seconds>}
+    """
+    megabytes = os.path.getsize(filename) / 1e6
+
+    def load(columnar):
+        s = schematic(pdf=False)
+        s.parse_file(filename, format='dfam', columnar=columnar)
+        return s.data
+
+    loaders = [("line by line (reference)", lambda: load_line_by_line(filename)),
+        ("parse_file, list of dicts", lambda: load(False)),
+        ("parse_file, columnar", lambda: load(True))]
+
+    times = {}
+    reference = None
+    print("{0}: {1:.1f} MB".format(filename, megabytes))
+    for name, func in loaders:
+        seconds, records = best_time(func, repeats)
+        records = [r if isinstance(r, dict) else r.as_dict() for r in records]
+        if reference is None:
+            reference = records
+        assert records == reference, '{0} does not match the line by line parser'.format(name)
+        times[name] = seconds
+        print("  {0:<28} {1:7.3f} s {2:8.1f} MB/s {3:6.1f}x".format(name, seconds, megabytes / seconds, times[loaders[0][0]] / seconds))
+    return times
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "synthetic.hits")
+            write_synthetic(filename)
+            run(filename)
@@ -0,0 +1,178 @@
+"""
+
+Binary sidecar cache of parsed domain files
+
+A parsed domain_store is written next to the source file as <filename>.ddcache.
+Later loads mmap the cache and wrap the arrays in place, so nothing is parsed
+or copied, and several processes opening the same cache share the same pages.
+
+Layout:
+    8 bytes     magic, b'DDCACHE\\0'
+    uint32      format version
+    uint32      length of the JSON header
+    JSON header source key (size, mtime, content hash), the format and parser
+                version it was parsed with, vocabularies and the
+                dtype/offset/count of each array
+    arrays      raw little-endian array data, each aligned to ALIGN bytes
+
+"""
+
+import os, json, mmap, struct, hashlib
+
+import numpy
+
+from .store import domain_store
+
+MAGIC = b'DDCACHE\0'
+VERSION = 2
+ALIGN = 64
+
+# Bump when a change to a parser changes what it reads from a file, so caches are re-parsed
+PARSER_VERSION = 1
+
+def cache_filename_for(filename):
+    return '{0}.ddcache'.format(filename)
+
+def hash_file(filename):
+    """
+    **Purpose**
+        Content hash of filename, as a hex string
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def source_key(filename, content_hash=None):
+    st = os.stat(filename)
+    if content_hash is None:
+        content_hash = hash_file(filename)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': content_hash}
+
+def save_cache(store, filename, cache_filename=None, format='fasta_style'):
+    """
+    **Purpose**
+        Write store to a binary cache for the source file filename
+
+    **Arguments**
+        store
+            the domain_store parsed from filename
+
+        filename
+            the source domain file. Its size, mtime and content hash key the cache.
+
+        cache_filename (Optional, default=<filename>.ddcache)
+            where to write the cache
+
+        format (Optional, default='fasta_style')
+            the parse_file() format store was parsed with
+
+    **Returns**
+        The cache filename
+    """
+    if not cache_filename:
+        cache_filename = cache_filename_for(filename)
+
+    arrays = {}
+    for name in domain_store.array_names:
+        a = numpy.ascontiguousarray(getattr(store, name))
+        arrays[name] = a.astype(a.dtype.newbyteorder('<'), copy=False)
+
+    header = {'source': source_key(filename),
+        'format': [format, PARSER_VERSION],
+        'vocab': {name: getattr(store, name) for name in domain_store.vocab_names},
+        'arrays': {}}
+
+    # The header size is not known yet, so array offsets are relative to the (aligned) data start
+    offset = 0
+    for name, a in arrays.items():
+        header['arrays'][name] = [a.dtype.str, offset, len(a)]
+        offset += a.nbytes
+        offset += -offset % ALIGN
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = len(MAGIC) + 8 + len(header_bytes)
+    data_start += -data_start % ALIGN
+
+    tmp_filename = '{0}.tmp{1}'.format(cache_filename, os.getpid())
+    with open(tmp_filename, 'wb') as oh:
+        oh.write(MAGIC)
+        oh.write(struct.pack('<II', VERSION, len(header_bytes)))
+        oh.write(header_bytes)
+        for name, a in arrays.items():
+            oh.write(b'\0' * (data_start + header['arrays'][name][1] - oh.tell()))
+            oh.write(a.tobytes())
+    os.replace(tmp_filename, cache_filename) # Readers never see a half written cache
+    return cache_filename
+
+def load_cache(filename, cache_filename=None, format='fasta_style'):
+    """
+    **Purpose**
+        Open the binary cache for filename, if there is a valid one.
+
+        The cache is valid if it was parsed with the same format and parser version,
+        and the source file has the same size and mtime as when it was written.
+        If only the mtime differs (e.g. the file was touched or copied), the content
+        hash is checked instead.
+
+    **Arguments**
+        filename
+            the source domain file
+
+        cache_filename (Optional, default=<filename>.ddcache)
+            the cache to open
+
+        format (Optional, default='fasta_style')
+            the parse_file() format the file is being read as
+
+    **Returns**
+        A domain_store whose arrays are read-only views onto the mmapped cache,
+        or None if there is no cache, or it is stale or corrupt.
+    """
+    if not cache_filename:
+        cache_filename = cache_filename_for(filename)
+    if not os.path.exists(cache_filename):
+        return None
+
+    with open(cache_filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return None
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        return _read_cache(mm, filename, format)
+    except (struct.error, ValueError, KeyError, TypeError):
+        # Truncated or corrupt, e.g. by a full disk. Parse again rather than fail.
+        print("Warning: '%s' is corrupt, parsing again" % cache_filename)
+        return None
+
+def _read_cache(mm, filename, format):
+    # load_cache() of an open, mmapped cache
+    if mm[:len(MAGIC)] != MAGIC:
+        return None
+    version, header_len = struct.unpack('<II', mm[len(MAGIC):len(MAGIC)+8])
+    if version != VERSION:
+        return None
+
+    header_start = len(MAGIC) + 8
+    header = json.loads(mm[header_start:header_start+header_len].decode('utf-8'))
+    data_start = header_start + header_len
+    data_start += -data_start % ALIGN
+
+    if header['format'] != [format, PARSER_VERSION]:
+        return None
+
+    st = os.stat(filename)
+    key = header['source']
+    if st.st_size != key['size']:
+        return None
+    if st.st_mtime_ns != key['mtime_ns'] and hash_file(filename) != key['hash']:
+        return None
+
+    store = domain_store()
+    for name, (dtype, offset, count) in header['arrays'].items():
+        setattr(store, name, numpy.frombuffer(mm, dtype=numpy.dtype(dtype), count=count, offset=data_start+offset))
+    for name in domain_store.vocab_names:
+        setattr(store, name, header['vocab'][name])
+    return store
@@ -4,34 +4,282 @@ draw domain alignments
 
 """
 
-import sys, os, gc, random
+import sys, os, io, gc, random, itertools
+from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from optparse import OptionParser
-import gzip as gzipfile
 
 from .data import *
 from .tools import *
-from .adjustText import adjust_text
-
-import matplotlib
-#matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-from matplotlib.lines import Line2D
+from .store import domain_store
+from .fileio import open_domain_file, iter_text_blocks, tab_fields, int_fields, intern_fields, detect_compression, split_at_records
+from .cache import load_cache, save_cache
+from .index import load_index, read_record
+from .svg import svg_canvas
+from .raster import raster_canvas, png_encode
+from .atlas import atlas_writer
+from .manifest import render_key, render_manifest
+from .sinks import open_sink
+from .layout import layout_params, xlims, label_tiers, dataset_layout, LABEL_Y, AX_POSITION, AX_YLIM, AXLAB_POSITION, AXLAB_YLIM
+
+import numpy
+# matplotlib (pyplot in particular) and adjustText are slow to import, and are only
+# imported by the code that draws with them, so the other paths start quickly.
+
+def parse_fasta_style_lines(lines):
+    """
+    **Purpose**
+        Turn an iterable of 'fasta_style' lines into protein dicts, see schematic.iter_records()
+
+    **Returns**
+        A generator of protein dicts
+    """
+    # files apear to be a bit like FASTA files, then tab separated elements
+
+    item = None
+
+    for line in lines:
+        if line:
+            if ">" in line:
+                # yield the last item
+                if item:
+                    yield item
+                # Get a new item
+                try:
+                    type = " ".join(line.split()[1:])
+                    if "/" in type:
+                        type = "Mixed:%s" % type
+                except IndexError: # There is no type
+                    type = None
+
+                item = {"name": line.strip().split()[0].replace(">", ""),
+                    "type": type, "domains": [], "len": 1}
+            else:
+                l = line.split()
+                if len(l) == 7:
+                    item["domains"].append({"name": l[5], "pos": (int(l[3])-1, int(l[4])-1), "db": l[2], "fam": l[6]}) # The display is zero-ordered. Correct positions.
+                elif len(l) == 6: # the family/specific column is missing. Seen in the wild occasionally
+                    item["domains"].append({"name": l[5], "pos": (int(l[3])-1, int(l[4])-1), "db": l[2]}) # The display is zero-ordered. Correct positions.
+
+                item["len"] = int(l[1])
+
+    if item: # Make sure the last item gets yielded
+        yield item
+
+def _check_new_protein(seen, name):
+    # The row parsers stream, so a protein that comes back can't be merged into its first record
+    if name in seen:
+        raise ValueError("the rows of '{0}' are not all together. Sort the file by protein first, e.g. sort -s -t$'\\t' -k1,1".format(name))
+    seen.add(name)
+
+def parse_interproscan_tsv_lines(lines):
+    """
+    **Purpose**
+        Turn an iterable of InterProScan TSV lines into protein dicts, grouping
+        consecutive rows of the same protein (InterProScan writes them grouped).
+        A protein whose rows are not all together raises ValueError, rather
+        than being split over several records.
+
+        Columns:
+        <protein>   <md5>   <length>    <analysis>  <signature accession>   <signature description> <start> <stop>  ...
+
+        The signature accession (PF00179, SM00355, SSF54695, ...) becomes "db", and the
+        signature description (or the accession, if there is none) the domain "name".
+
+    **Returns**
+        A generator of protein dicts
+    """
+    item = None
+    seen = set() # proteins already started
+
+    for line in lines:
+        if not line.strip() or line[0] == "#":
+            continue
+        l = line.rstrip("\n").split("\t")
+
+        if not item or item["name"] != l[0]:
+            if item:
+                yield item
+            _check_new_protein(seen, l[0])
+            item = {"name": l[0], "type": "", "domains": [], "len": int(l[2])}
+
+        name = l[5] if len(l) > 5 and l[5] not in ("", "-") else l[4]
+        item["domains"].append({"name": name, "pos": (int(l[6])-1, int(l[7])-1), "db": l[4]}) # The display is zero-ordered. Correct positions.
+
+    if item:
+        yield item
+
+gff3_domain_types = set(['protein_match', 'protein_hmm_match'])
+
+def parse_gff3_lines(lines):
+    """
+    **Purpose**
+        Turn an iterable of GFF3 lines (as written by InterProScan) into protein dicts,
+        grouping consecutive features on the same seqid. As for
+        parse_interproscan_tsv_lines(), the features of a seqid must be together.
+
+        protein_match features are domains: the Name attribute (the signature accession)
+        becomes "db", and signature_desc (or Name) the domain "name". The protein
+        length comes from the polypeptide feature or the ##sequence-region pragma.
+        Anything after a ##FASTA line is ignored.
+
+    **Returns**
+        A generator of protein dicts
+    """
+    item = None
+    seen = set() # proteins already started
+    lengths = {} # from ##sequence-region
+
+    for line in lines:
+        if line.startswith("##FASTA"):
+            break
+        if line.startswith("##sequence-region"):
+            l = line.split()
+            lengths[unquote(l[1])] = int(l[3])
+            continue
+        if not line.strip() or line[0] == "#":
+            continue
+
+        l = line.rstrip("\n").split("\t")
+        seqid = unquote(l[0])
+
+        if not item or item["name"] != seqid:
+            if item:
+                yield item
+            _check_new_protein(seen, seqid)
+            item = {"name": seqid, "type": "", "domains": [], "len": lengths.pop(seqid, 1)}
+
+        if l[2] == "polypeptide":
+            item["len"] = int(l[4])
+        elif l[2] in gff3_domain_types:
+            attributes = dict(a.split("=", 1) for a in l[8].strip().split(";") if "=" in a)
+            acc = unquote(attributes.get("Name", l[1]))
+            name = unquote(attributes.get("signature_desc", acc))
+            item["domains"].append({"name": name, "pos": (int(l[3])-1, int(l[4])-1), "db": acc}) # The display is zero-ordered. Correct positions.
+            item["len"] = max(item["len"], int(l[4]))
+
+    if item:
+        yield item
+
+style_col_maps = {
+    'ubl': ubl_col_map,
+    'pfsmsff': acast_col_map,
+    'unk_domains': unk_domains,
+    'ptp': ptp_map,
+    }
+
+record_parsers = {
+    'fasta_style': parse_fasta_style_lines,
+    'interproscan_tsv': parse_interproscan_tsv_lines,
+    'gff3': parse_gff3_lines,
+    }
+
+def _parse_fasta_style_range(args):
+    # process pool worker for schematic.__load_fasta_style_parallel
+    filename, start, end = args
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        text = fh.read(end - start).decode('utf-8')
+
+    # Send back columns, not dicts: a few NumPy arrays pickle and merge far faster
+    gc.disable() # Only new, acyclic, dicts are made here, collections just slow it down.
+    try:
+        return domain_store.from_records(parse_fasta_style_lines(text.splitlines(True)))
+    finally:
+        gc.enable()
+
+def _box_collection(left, right, bottom, top, **kargs):
+    """
+    One PolyCollection of axis-aligned boxes, in place of a Rectangle patch per box.
+    left, right, bottom and top are sequences, one entry per box. kargs as PolyCollection
+    (facecolors, edgecolors, linewidths, zorder).
+    """
+    from matplotlib.collections import PolyCollection
+
+    verts = numpy.empty((len(left), 4, 2))
+    verts[:, 0, 0] = verts[:, 3, 0] = left
+    verts[:, 1, 0] = verts[:, 2, 0] = right
+    verts[:, 0, 1] = verts[:, 1, 1] = bottom
+    verts[:, 2, 1] = verts[:, 3, 1] = top
+    return PolyCollection(verts, closed=True, **kargs)
+
+class render_context:
+    """
+    A figure and its two axes, set up once and reused by schematic.draw() for
+    every item with the same figsize. Only the item's artists change between
+    items, and clear() removes them again.
+    """
+    def __init__(self, figsize):
+        import matplotlib.pyplot as plt
+        self.fig = plt.figure(figsize=figsize)
+
+        self.ax = self.fig.add_subplot(211)
+        self.axlab = self.fig.add_subplot(212)
+
+        self.ax.set_position(AX_POSITION)
+        self.axlab.set_position(AXLAB_POSITION)
+        self.axlab.set_facecolor('none')
+
+        for a in (self.ax, self.axlab):
+            a.set_xticklabels("")
+            a.set_yticklabels("")
+            a.set_ylabel("")
+            a.set_xlabel("")
+            a.tick_params(left=None, top=None, bottom=None, right=None)
+            a.set_frame_on(False)
+
+    def clear(self):
+        for a in (self.ax, self.axlab):
+            for artist in a.patches + a.texts + a.lines + a.collections:
+                artist.remove()
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.fig) # Free up the memory
+
+_draw_worker = None
+
+def _init_draw_worker(state):
+    # process pool initializer for schematic.iter_draw_all
+    global _draw_worker
+    import matplotlib
+    matplotlib.use('Agg', force=True) # headless
+    _draw_worker = schematic(pdf=state["pdf"], fixed=state["fixed"], svg=state["svg"], label_layout=state["label_layout"])
+    _draw_worker.__dict__.update(state)
+
+def _draw_batch(style, batch, in_memory=False):
+    out = []
+    for n, item, jobs in batch:
+        out += _draw_worker.draw_jobs(n, item, style, jobs, in_memory)
+    return out
 
 class schematic:
-    def __init__(self, pdf=True, fixed=True):
+    def __init__(self, pdf=True, fixed=True, svg=False, label_layout='adjust'):
         """
         **Purpose**
             initiator
 
+        **Arguments**
+            label_layout (Optional, default='adjust')
+                how the 'gen' and 'episcan' styles keep the domain labels apart:
+                'adjust' jitters them and moves them apart with adjust_text,
+                'tiers' stacks them into rows in one pass (see layout.label_tiers()),
+                which is much faster and gives the same image every time.
         """
+        assert label_layout in ('adjust', 'tiers'), "label_layout '{0}' not one of 'adjust', 'tiers'".format(label_layout)
         self.pdf = pdf
+        self.svg = svg
         self.fixed = fixed
+        self.label_layout = label_layout
         self.col_map = {}
+        self.max_len = 0
+        self.offset_index = None
+        self.output_path = "."
+        self.render_contexts = {} # figures are reused by draw(), see render_context
 
-    def parse_file(self, domain_filename,
+    def parse_file(self, domain_filename, format='fasta_style',
         gzip=False,
-        fixed=True, pdf=False, output_path=None, **kargs):
+        fixed=True, pdf=False, output_path=None, columnar=False, threads=None, cache=False, workers=None, **kargs):
         """
         **Purpose**
             Entry point for file parsing
@@ -41,9 +289,26 @@ class schematic:
                 filename to parse.
 
 
-            format (Required),
+            format (Optional, default='fasta_style'),
                 Format: 'dfam'
+                A Dfam .hits table, as in the genome annotation downloads from Dfam, tab separated:
+                #seq_name   family_acc  family_name bits    e-value bias    hmm-st  hmm-en  strand  ali-st  ali-en  env-st  env-en  sq-len  kimura_div
+
+                Hits are grouped into one item per seq_name, family_acc is used as the db,
+                family_name as the domain name, and ali-st/ali-en as the position.
+                nhmmscan --dfamtblout output is whitespace aligned, with other columns, and is not read.
 
+                Format: 'interproscan_tsv'
+                InterProScan TSV output (-f tsv), one row per match:
+                <protein>   <md5>   <length>    <analysis>  <signature accession>   <signature description> <start> <stop>  ...
+
+                Format: 'gff3'
+                InterProScan GFF3 output (-f gff3). protein_match features are the domains.
+
+                For both, the signature accession (PF00179, SM00355, SSF54695, ...) is used as the db,
+                the signature description as the domain name. Rows are grouped by protein
+                as they stream past, so they are expected to be grouped in the file (InterProScan does this).
+                A protein that comes back later in the file raises ValueError, sort the file first.
 
 
                 Format: 'fasta_style'
@@ -58,7 +323,11 @@ class schematic:
                     <id>    <length of protein> <HMM ID>    <left>  <right> <name>  <type>
 
             gzip (Optional, default=False)
-                Is the domain_filename gzipped?
+                Ignored. Kept for compatibility, gzip, BGZF, xz and zstd
+                compressed files are detected automatically.
+
+            threads (Optional, default=None)
+                Number of threads to decompress BGZF files with. None uses all cores.
 
             fixed (Optional, default=True)
                 draw all schemas with a fixed length.
@@ -72,8 +341,28 @@ class schematic:
             output_path (Optional, default=None)
                 path to export the files to.
                 Will be created if not present (Not guaranteed to work).
+
+            columnar (Optional, default=False)
+                Store the parsed data in a compact domain_store (contiguous NumPy arrays)
+                instead of a list of dicts. Recommended for whole-proteome files.
+                Iterating over self.data then yields lightweight record views
+                that can be passed to draw().
+
+            cache (Optional, default=False)
+                Keep a binary cache of the parsed file next to it (<domain_filename>.ddcache),
+                and load from that (via mmap) on later runs, if the file is unchanged and is read with the same format.
+                Implies columnar=True.
+
+            workers (Optional, default=None)
+                Parse an uncompressed 'fasta_style' file with this many processes.
+                The file is cut into byte ranges on '>' header lines, each worker sends back
+                a domain_store of its range, and these are joined in file order, so the output
+                is identical to a serial parse. Compressed files are always parsed serially.
+                Experimental: the speed up has only been measured on a single core, where
+                it costs 5-10% over a serial parse. Most useful with columnar=True, without it
+                the joined store is unpacked into dicts in this process.
         """
-        valid_file_formats = set(['fasta_style', 'dfam'])
+        valid_file_formats = set(['fasta_style', 'dfam', 'interproscan_tsv', 'gff3'])
         assert format in valid_file_formats, '{0} not in {1} valid_file_formats'.format(format, valid_file_formats)
 
         if output_path:
@@ -86,19 +375,129 @@ class schematic:
 
         self.data = []
 
-        if format == 'fasta_style':
-            self.data = self.__load_fasta_style(filename, gzip)
+        if columnar or cache:
+            self.data = load_cache(domain_filename, format=format) if cache else None
+            if self.data is None:
+                if format == 'fasta_style' and self.__can_parse_parallel(domain_filename, workers):
+                    self.data = self.__load_fasta_style_parallel(domain_filename, workers)
+                elif format in record_parsers:
+                    self.data = domain_store.from_records(self.iter_records(domain_filename, gzip, threads, format))
+                elif format == 'dfam':
+                    self.data = self.__load_dfam_columnar(domain_filename, gzip, threads)
+                if cache:
+                    try:
+                        save_cache(self.data, domain_filename, format=format)
+                    except OSError as e:
+                        print("Warning: could not write the cache for '%s' (%s)" % (domain_filename, e))
+            self.max_len = self.data.max_len()
+        elif format == 'fasta_style' and self.__can_parse_parallel(domain_filename, workers):
+            self.data = self.__load_fasta_style_parallel(domain_filename, workers).to_records()
+            self.max_len = max([item["len"] for item in self.data], default=0)
+        elif format == 'fasta_style':
+            self.data = self.__load_fasta_style(domain_filename, gzip, threads)
+        elif format in record_parsers:
+            self.data = self.__load_records(domain_filename, format, gzip, threads)
         elif format == 'dfam':
-            self.data = self.__load_dfam_style(filename, gzip)
+            self.data = self.__load_dfam_style(domain_filename, gzip, threads)
 
-    def __load_fasta_style(self, filename, gzip=False):
+    def iter_records(self, filename, gzip=False, threads=None, format='fasta_style'):
         """
+        **Purpose**
+            Stream the proteins in a domain file, one at a time.
 
+            Only a single protein is held in memory, so this is suitable for
+            whole-proteome files that are too large to load with parse_file().
+
+        **Arguments**
+            filename
+                filename to parse.
+
+            gzip (Optional, default=False)
+                Ignored, compression is detected automatically. See fileio.open_domain_file()
 
+            threads (Optional, default=None)
+                Number of threads to decompress BGZF files with. None uses all cores.
+
+            format (Optional, default='fasta_style')
+                One of 'fasta_style', 'interproscan_tsv' or 'gff3'. See parse_file()
+
+        **Returns**
+            A generator, yielding one dictionary per protein, in the same form
+            draw() expects:
+            {"name": <name>,
+            "type": <type>,
+            "domains: [<list of domains> {"name": <name>, "pos": (l, r), "db": <HMM ID>, "fam": <family>},
+            "len": <length of protein>
+            }
+        """
+        assert format in record_parsers, '{0} not in {1} streamable formats'.format(format, set(record_parsers))
+
+        oh = open_domain_file(filename, threads=threads)
+        try:
+            for item in record_parsers[format](oh):
+                yield item
+        finally:
+            oh.close()
+
+    def open_index(self, domain_filename):
         """
-        pass
+        **Purpose**
+            Open a (uncompressed) 'fasta_style' domain file for random access with get() and render().
+
+            An offset index (<domain_filename>.ddi) is built the first time,
+            and reused afterwards unless the file changes. Nothing else is parsed.
+            The index records the length of each protein, so the dataset max_len
+            (used when not fixed) is known without a full parse.
 
-    def __load_fasta_style(self, filename, gzip=False):
+        **Arguments**
+            domain_filename
+                filename to index.
+
+        **Returns**
+            The number of proteins in the index
+        """
+        self.indexed_filename = domain_filename
+        self.offset_index = load_index(domain_filename)
+        self.max_len = max([entry[2] for entry in self.offset_index.values()], default=0)
+        return len(self.offset_index)
+
+    def get(self, name):
+        """
+        **Purpose**
+            Seek to and parse a single protein from the file opened with open_index()
+
+        **Arguments**
+            name
+                the protein name, as in the '>' header
+
+        **Returns**
+            A dictionary in the form returned by iter_records()
+        """
+        assert self.offset_index is not None, 'call open_index() before get()'
+        assert name in self.offset_index, "'{0}' not found in {1}".format(name, self.indexed_filename)
+
+        record = read_record(self.indexed_filename, self.offset_index, name)
+        return next(parse_fasta_style_lines(record.splitlines(True)))
+
+    def render(self, name, filename, style='episcan', thumb=False):
+        """
+        **Purpose**
+            get() a single protein and draw() it
+
+        **Arguments**
+            name
+                the protein name
+
+            filename
+                the image filename to save to
+
+            style, thumb
+                see draw()
+        """
+        self.__set_col_map(style)
+        self.draw(self.get(name), filename, style, thumb)
+
+    def __load_fasta_style(self, filename, gzip=False, threads=None):
         '''
                         Expected format:
                 >AGAP004733-PA  BTB
@@ -110,46 +509,138 @@ class schematic:
                     [List of domains]
                     <id>    <length of protein> <HMM ID>    <left>  <right> <name>  <type>
         '''
-        oh = open(filename, "rt")
-        # files apear to be a bit like FASTA files, then tab separated elements
+        return self.__load_records(filename, 'fasta_style', gzip, threads)
 
-        item = None
-        types = []
+    def __load_records(self, filename, format, gzip=False, threads=None):
+        '''
+        Load all of the items from iter_records() into a list
+        '''
+        data = []
 
         self.max_len = 0 # get the maximum length of the peptides
-        for line in oh:
-            if line:
-                if ">" in line:
-                    # append the last item to the list
-                    if item:
-                        self.data.append(item)
-                    # Get a new item
-                    try:
-                        type = " ".join(line.split()[1:])
-                        if "/" in type:
-                            type = "Mixed:%s" % type
-                    except IndexError: # There is no type
-                        type = None
-
-                    item = {"name": line.strip().split()[0].replace(">", ""),
-                        "type": type, "domains": [], "len": 1}
-                else:
-                    l = line.split()
-                    if len(l) == 7:
-                        item["domains"].append({"name": l[5], "pos": (int(l[3])-1, int(l[4])-1), "db": l[2], "fam": l[6]}) # The display is zero-ordered. Correct positions.
-                    elif len(l) == 6: # the family/specific column is missing. Seen in the wild occasionally
-                        item["domains"].append({"name": l[5], "pos": (int(l[3])-1, int(l[4])-1), "db": l[2]}) # The display is zero-ordered. Correct positions.
+        for item in self.iter_records(filename, gzip, threads, format):
+            if self.max_len < item["len"]:
+                self.max_len = item["len"]
+            data.append(item)
 
-                    item["len"] = int(l[1])
-                    if self.max_len < item["len"]:
-                        self.max_len = item["len"]
+        return data
 
-        if item: # Make sure the last item gets added
-            self.data.append(item)
+    def __can_parse_parallel(self, filename, workers):
+        return workers is not None and workers > 1 and detect_compression(filename) is None
 
-        oh.close()
+    def __load_fasta_style_parallel(self, filename, workers):
+        '''
+        Parse byte ranges of an uncompressed 'fasta_style' file in a process pool.
+        Each worker returns a domain_store of its range, and these are joined in file order.
+        '''
+        ranges = split_at_records(filename, workers * 4) # A few chunks per worker to balance the load
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return domain_store.concatenate(pool.map(_parse_fasta_style_range, [(filename, start, end) for start, end in ranges]))
 
-    def draw_all(self, style="ubl", thumbs=False):
+    def __iter_dfam_columns(self, filename, threads=None):
+        '''
+                Expected format, a Dfam .hits table (tab separated, '#' lines are ignored):
+                #seq_name   family_acc  family_name bits    e-value bias    hmm-st  hmm-en  strand  ali-st  ali-en  env-st  env-en  sq-len  kimura_div
+                chr1    DF0000001   MIR 25.3    3.2e-05 0.0 52  168 -   12640   12526   12645   12510   248956422   26.1
+
+        The file is read as bytes, in large blocks. The fields of a whole block are
+        found at once with NumPy, the positions and lengths are converted a column
+        at a time, and the names are interned per block, so no Python objects
+        are made per hit.
+
+        Yields (seq_names, family_accs, family_names, lefts, rights, seq_lens) per block.
+        The names are (<ids>, <vocab>) pairs, with ids into the block's own vocab,
+        the positions and lengths are NumPy arrays.
+        '''
+        ncols = None
+        oh = open_domain_file(filename, threads=threads, binary=True)
+        try:
+            for block in iter_text_blocks(oh, 1 << 24):
+                while block and (block[:1] == b"#" or block[:block.index(b"\n")].isspace() or block[:1] == b"\n"): # the header
+                    block = block[block.index(b"\n")+1:]
+                if b"\n#" in block:
+                    block = b"".join(l for l in block.splitlines(True) if l[:1] != b"#")
+                if not block:
+                    continue
+                if ncols is None:
+                    ncols = block[:block.index(b"\n")].count(b"\t") + 1
+                    assert ncols >= 14, '{0} is not a tab separated Dfam .hits table, its first line has {1} fields'.format(filename, ncols)
+
+                fields = tab_fields(block, ncols)
+                if fields is None: # blank or ragged lines, keep the first 14 fields of each
+                    block = b"".join(b"\t".join(l.split(b"\t")[:14]) + b"\n" for l in block.splitlines() if not l.isspace() and l)
+                    fields = tab_fields(block, 14)
+                    if fields is None:
+                        raise ValueError('{0} has lines with fewer than 14 tab separated fields'.format(filename))
+                buf, starts, ends = fields
+
+                ali_st = int_fields(buf, starts[:, 9], ends[:, 9])
+                ali_en = int_fields(buf, starts[:, 10], ends[:, 10])
+                # '-' strand hits have ali-st > ali-en. The display is zero-ordered. Correct positions.
+                lefts = numpy.minimum(ali_st, ali_en) - 1
+                rights = numpy.maximum(ali_st, ali_en) - 1
+
+                yield (intern_fields(buf, starts[:, 0], ends[:, 0]), intern_fields(buf, starts[:, 1], ends[:, 1]),
+                    intern_fields(buf, starts[:, 2], ends[:, 2]), lefts, rights, int_fields(buf, starts[:, 13], ends[:, 13]))
+        finally:
+            oh.close()
+
+    def __load_dfam_style(self, filename, gzip=False, threads=None):
+        '''
+        Load a Dfam hits table into the same structure as __load_fasta_style,
+        one item per seq_name. See __iter_dfam_columns for the format.
+        '''
+        items = {} # seq_name: item, in order of first appearance
+
+        self.max_len = 0 # get the maximum length of the sequences
+        gc_was_enabled = gc.isenabled()
+        gc.disable() # Only new, acyclic, dicts are made here, collections just slow it down.
+        try:
+            for (seq_ids, seq_vocab), (acc_ids, acc_vocab), (fam_ids, fam_vocab), lefts, rights, seq_lens in self.__iter_dfam_columns(filename, threads):
+                self.max_len = max(self.max_len, int(seq_lens.max()))
+
+                domains = [{"name": fam_vocab[n], "pos": (l, r), "db": acc_vocab[a]} for n, l, r, a in zip(fam_ids.tolist(), lefts.tolist(), rights.tolist(), acc_ids.tolist())]
+
+                # hits are (almost always) sorted by sequence, so add them in runs
+                run_starts = [0] + (numpy.flatnonzero(seq_ids[1:] != seq_ids[:-1]) + 1).tolist()
+                run_ends = run_starts[1:] + [len(seq_ids)]
+                for s, e in zip(run_starts, run_ends):
+                    seq_name = seq_vocab[seq_ids[s]]
+                    if seq_name not in items:
+                        items[seq_name] = {"name": seq_name, "type": "", "domains": [], "len": int(seq_lens[s])}
+                    items[seq_name]["domains"].extend(domains[s:e])
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        return list(items.values())
+
+    def __load_dfam_columnar(self, filename, gzip=False, threads=None):
+        '''
+        Load a Dfam hits table straight into a domain_store, without making
+        any per-hit Python objects. See __iter_dfam_columns for the format.
+        '''
+        tables = ({}, {}, {}) # seq_name, family_acc, family_name: id, over the whole file
+        ids = ([], [], [])
+        lefts, rights, seq_lens = [], [], []
+        for block in self.__iter_dfam_columns(filename, threads):
+            for table, out, (block_ids, block_vocab) in zip(tables, ids, block[:3]):
+                # Renumber the block's ids into the file's, in order of first appearance
+                table.update(zip([v for v in block_vocab if v not in table], itertools.count(len(table))))
+                remap = numpy.fromiter(map(table.__getitem__, block_vocab), dtype=numpy.int32, count=len(block_vocab))
+                out.append(remap[block_ids])
+            lefts.append(block[3])
+            rights.append(block[4])
+            seq_lens.append(block[5])
+
+        if not lefts:
+            return domain_store()
+
+        seqs, accs, fam_names = [(numpy.concatenate(out), list(table)) for table, out in zip(tables, ids)]
+        return domain_store.from_interned_columns(seqs, numpy.concatenate(seq_lens),
+            numpy.concatenate(lefts), numpy.concatenate(rights), fam_names, accs)
+
+    def draw_all(self, style="ubl", thumbs=False, workers=None, backend='matplotlib', thumb_path=None, thumb_backend=None, thumb_fixed=True, incremental=False, sink=None):
         """
         **Purpose**
             Just a simple helper function when you want to draw all motifs from the file
@@ -158,31 +649,258 @@ class schematic:
             style
                 "ubl" - the UBL domain E2,E3 style
                 "pfsmsff" - PFAM, SFF, SMART colours
+                "gen" - generic grey boxes, with labels
+
+            thumbs (Optional, default=False)
+                False - draw full size images
+                True - draw thumbnails
+                "both" - draw the full size image and the thumbnail of each item in the
+                    same pass. The thumbnails go to thumb_path.
+
+            workers (Optional, default=None)
+                draw with a pool of this many processes, each using the Agg backend.
+                Use iter_draw_all() to follow the progress.
+
+            backend (Optional, default='matplotlib')
+                see draw()
+
+            thumb_path (Optional, default=None)
+                where to save the thumbnails when thumbs="both"
+
+            thumb_backend (Optional, default=backend)
+                the backend for the thumbnails when thumbs="both", e.g. 'raster'
+
+            thumb_fixed (Optional, default=True)
+                draw the thumbnails with a fixed length when thumbs="both", whatever
+                fixed is for the full size images, so short proteins are not a few pixels wide
+
+            incremental (Optional, default=False)
+                only redraw the images whose record, style, colour map or layout
+                settings have changed since the last incremental run, see manifest.py
+
+            sink (Optional, default=None)
+                write the images to this sink (see sinks.py), e.g. open_sink("out.zip"),
+                instead of saving them as files. Filenames, including the output_path and
+                thumb_path, become the names in the sink. The sink is not closed.
+
+        **Returns**
+            None and a file per item in output_path, see output_filename()
         """
-        if style == "ubl":
-            self.col_map = ubl_col_map
-        elif style == "pfsmsff":
-            self.col_map = acast_col_map
-        elif style == "unk_domains":
-            self.col_map = unk_domains
-        elif style == "ptp":
-            self.col_map = ptp_map
-
-        for n, item in enumerate(self.data):
-            if style == "ubl":
-                self.draw(item, self.__draw_ubl_style, thumbs)
-            elif style == "pfsmsff":
-                self.draw(item, self.__draw_db_style, thumbs)
-            elif style == "gen":
-                self.draw(item, self.__draw_gen_style, thumbs)
-            elif style == "unk_domains":
-                self.draw(item, self.__draw_unk_style, thumbs)
-            elif style == "ptp":
-                self.draw(item, self.__draw_ubl_style, thumbs)
+        for n, filename in self.iter_draw_all(style, thumbs, workers, backend=backend, thumb_path=thumb_path, thumb_backend=thumb_backend,
+            thumb_fixed=thumb_fixed, incremental=incremental, sink=sink):
+            pass
 
         return(None)
 
-    def draw(self, item, filename, style, thumb=False):
+    def iter_draw_all(self, style="ubl", thumbs=False, workers=None, batch_size=16, backend='matplotlib', thumb_path=None, thumb_backend=None, thumb_fixed=True, incremental=False, sink=None):
+        """
+        **Purpose**
+            As draw_all(), but yield as each image is saved, for progress reporting
+
+        **Arguments**
+            style, thumbs, workers, backend, thumb_path, thumb_backend, thumb_fixed, incremental, sink
+                see draw_all()
+
+            batch_size (Optional, default=16)
+                number of items sent to a worker process at a time
+
+        **Returns**
+            A generator of (<index of the item in self.data>, <filename>).
+            With workers these arrive in the order they finish, not file order.
+            Images skipped by incremental are not yielded. Nor are the images of an item
+            with the same name as an earlier one, which would overwrite it (with a warning).
+        """
+        self.__set_col_map(style)
+        assert not (incremental and sink), 'incremental=True only works with plain files, not a sink'
+
+        # (thumb, backend, output path, fixed) of each image to draw per item
+        if thumbs == "both":
+            assert thumb_path, 'thumbs="both" needs a thumb_path'
+            jobs = [(False, backend, self.output_path, self.fixed), (True, thumb_backend or backend, thumb_path, thumb_fixed)]
+        else:
+            jobs = [(bool(thumbs), backend, self.output_path, self.fixed)]
+
+        manifests = {}
+        keys = {} # (n, filename): (output path, render_key) of the images still to draw
+        drawn = set() # filenames already handed out, items with the same name would share one
+        if incremental:
+            manifests = {job[2]: render_manifest(job[2]) for job in jobs}
+
+        def items():
+            # (n, item, the jobs that need drawing)
+            for n, item in enumerate(self.data):
+                if not isinstance(item, dict):
+                    item = item.as_dict() # Only unpack a record_view once, for all of the jobs
+
+                todo = []
+                for job in jobs:
+                    filename = self.output_filename(item, job[1], job[2], job[0])
+                    if filename in drawn:
+                        print("Warning: more than one item is named '%s', only the first is drawn to '%s'" % (item["name"], filename))
+                        continue
+                    drawn.add(filename)
+                    if incremental:
+                        key = self.__render_key(item, style, job)
+                        if manifests[job[2]].is_current(filename, key):
+                            continue
+                        keys[(n, filename)] = (job[2], key)
+                    todo.append(job)
+                if todo:
+                    yield n, item, todo
+
+        def done(n, filename, data=None):
+            if sink:
+                sink.write(filename, data)
+            if incremental:
+                path, key = keys.pop((n, filename))
+                manifests[path].update(filename, key)
+            return n, filename
+
+        try:
+            if not workers or workers <= 1:
+                for n, item, todo in items():
+                    for result in self.draw_jobs(n, item, style, todo, sink is not None):
+                        yield done(*result)
+                return
+
+            state = {"fixed": self.fixed, "pdf": self.pdf, "svg": self.svg, "label_layout": self.label_layout, "max_len": self.max_len,
+                "col_map": self.col_map, "output_path": self.output_path}
+
+            def batches():
+                batch = []
+                for n, item, todo in items():
+                    batch.append((n, dict(item), todo))
+                    if len(batch) == batch_size:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_draw_worker, initargs=(state,)) as pool:
+                pending = set()
+                for batch in batches():
+                    if len(pending) >= workers * 4: # Don't queue up the whole dataset
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for f in finished:
+                            for result in f.result():
+                                yield done(*result)
+                    pending.add(pool.submit(_draw_batch, style, batch, sink is not None))
+
+                for f in pending:
+                    for result in f.result():
+                        yield done(*result)
+        finally:
+            for manifest in manifests.values():
+                manifest.save() # Also keep the progress of an interrupted run
+
+    def __render_key(self, item, style, job):
+        """
+        render_key() of the image job = (thumb, backend, output path, fixed) makes of item
+        """
+        thumb, backend, path, fixed = job
+        settings = {"thumb": thumb, "backend": backend, "fixed": fixed, "pdf": self.pdf, "svg": self.svg,
+            "max_len": None if fixed else self.max_len} # Only scaled images depend on the other items
+        if self.label_layout != 'adjust': # Keep the keys of existing manifests
+            settings["label_layout"] = self.label_layout
+        return render_key(item, style, self.col_map, settings)
+
+    def draw_jobs(self, n, item, style, jobs, in_memory=False):
+        """
+        **Purpose**
+            draw() one item once for each (thumb, backend, output path, fixed) in jobs
+
+        **Arguments**
+            in_memory (Optional, default=False)
+                don't save the images, and return them instead, see draw_bytes()
+
+        **Returns**
+            A generator of (n, <filename>), as each image is saved.
+            Or (n, <filename>, <image bytes>) if in_memory
+        """
+        for thumb, backend, path, fixed in jobs:
+            filename = self.output_filename(item, backend, path, thumb)
+            if in_memory:
+                yield n, filename, self.draw_bytes(item, style, thumb, backend, os.path.splitext(filename)[1][1:], fixed=fixed)
+            else:
+                self.draw(item, filename, style, thumb, backend, fixed=fixed)
+                yield n, filename
+
+    def layout_all(self, style="ubl", thumb=False):
+        """
+        **Purpose**
+            Work out the geometry of every item, without drawing anything,
+            e.g. to send to a client that draws the schematics itself
+
+        **Arguments**
+            style
+                'ubl', 'ptp', 'gen' or 'episcan'
+
+            thumb (Optional, default=False)
+                lay out thumbnails rather than full size images
+
+        **Returns**
+            A dataset_layout, see layout.py. Save it with save_json() or save_npz()
+        """
+        self.__set_col_map(style)
+        store = self.data if isinstance(self.data, domain_store) else domain_store.from_records(self.data)
+        return dataset_layout.from_store(store, style, self.col_map, self.fixed, thumb, self.max_len)
+
+    def draw_atlas(self, style="ubl", path=None, columns=32, rows=64, backend='raster', prefix="atlas", fixed=None):
+        """
+        **Purpose**
+            Draw the thumbnails of all items into a few large sheet images,
+            rather than one file per item. See atlas.py for the index format.
+
+        **Arguments**
+            style
+                see draw_all()
+
+            path (Optional, default=output_path)
+                where to save the sheets and the index
+
+            columns, rows (Optional, default=32, 64)
+                number of thumbnails across and down each sheet
+
+            backend (Optional, default='raster')
+                'raster' or 'matplotlib', see draw_pixels()
+
+            prefix (Optional, default="atlas")
+                sheets are saved as <prefix>_0000.png ..., the index as <prefix>.json
+
+            fixed (Optional, default=None)
+                see draw()
+
+        **Returns**
+            The filename of the index
+        """
+        self.__set_col_map(style)
+
+        with atlas_writer(path or self.output_path, columns, rows, prefix) as atlas:
+            for item in self.data:
+                atlas.add(item["name"], self.draw_pixels(item, style, thumb=True, backend=backend, fixed=fixed))
+        return os.path.join(atlas.path, "%s.json" % prefix)
+
+    def output_filename(self, item, backend='matplotlib', path=None, thumb=False):
+        """
+        **Purpose**
+            The filename draw_all() saves item to: <path>/<name>.png
+            .pdf if pdf=True, .svg for full size images if svg=True or for the 'svg-native' backend
+
+            path defaults to output_path
+        """
+        if backend == 'svg-native' or (self.svg and not thumb and backend == 'matplotlib'):
+            ext = "svg"
+        elif backend == 'raster':
+            ext = "png"
+        else:
+            ext = "pdf" if self.pdf else "png"
+        return os.path.join(path or self.output_path, "%s.%s" % (item["name"].replace(os.sep, "_"), ext))
+
+    def __set_col_map(self, style):
+        if style in style_col_maps:
+            self.col_map = style_col_maps[style]
+
+    def draw(self, item, filename, style, thumb=False, backend='matplotlib', fixed=None):
         """
         **Purpose**
             draw the item.
@@ -196,66 +914,166 @@ class schematic:
                 "len": <length of protein>
                 }
 
+            filename
+                the filename to save the image to
+
+            style
+                the drawing style, see draw_all()
+
+            thumb (Optional, default=False)
+                draw a small thumbnail, with no text
+
+            backend (Optional, default='matplotlib')
+                'matplotlib' - draw with matplotlib, filename can be any format it supports
+                'svg-native' - write an SVG file directly, without matplotlib. Much faster.
+                    Only the 'ubl', 'ptp', 'gen' and 'episcan' styles are available.
+                'raster' - thumbnails only. Paint the boxes into a NumPy array and write
+                    it as a PNG, without matplotlib. Same styles as 'svg-native'.
+
+            fixed (Optional, default=None)
+                draw with a fixed length (True) or scaled to max_len (False). None uses self.fixed
+
         **Returns**
             None and a file in <item>.png
         """
+        canvas = self.__render(item, style, thumb, backend, fixed)
+        if backend == 'matplotlib':
+            canvas.fig.savefig(filename)
+            canvas.clear() # Ready for the next item
+        else:
+            canvas.save(filename)
+
+    def draw_bytes(self, item, style, thumb=False, backend='matplotlib', format='png', fixed=None):
+        """
+        **Purpose**
+            draw the item, and return the image file in memory, rather than saving it
+
+        **Arguments**
+            item, style, thumb, backend, fixed
+                see draw()
+
+            format (Optional, default='png')
+                the file format for backend='matplotlib', e.g. 'png', 'pdf' or 'svg'.
+                'svg-native' always makes SVG, and 'raster' PNG.
+
+        **Returns**
+            The image file, as bytes
+        """
+        canvas = self.__render(item, style, thumb, backend, fixed)
+        if backend == 'svg-native':
+            return canvas.tostring().encode('utf-8')
+        elif backend == 'raster':
+            return png_encode(canvas.render())
+
+        buffer = io.BytesIO()
+        canvas.fig.savefig(buffer, format=format)
+        canvas.clear() # Ready for the next item
+        return buffer.getvalue()
+
+    def draw_pixels(self, item, style, thumb=True, backend='raster', fixed=None):
+        """
+        **Purpose**
+            draw the item into memory, rather than to a file
+
+        **Arguments**
+            item, style, thumb, fixed
+                see draw()
+
+            backend (Optional, default='raster')
+                'raster' or 'matplotlib' (rendered with the Agg backend), see draw()
+
+        **Returns**
+            A (height, width, 4) uint8 RGBA array
+        """
+        assert backend in ('matplotlib', 'raster'), "draw_pixels() backend must be 'matplotlib' or 'raster'"
+        canvas = self.__render(item, style, thumb, backend, fixed)
+        if backend == 'raster':
+            return canvas.render()
+
+        canvas.fig.canvas.draw()
+        pixels = numpy.array(canvas.fig.canvas.buffer_rgba()) # copy, the buffer is reused
+        canvas.clear()
+        return pixels
+
+    def __render(self, item, style, thumb, backend, fixed=None):
+        """
+        Draw item, and return the render_context (matplotlib) or the native canvas,
+        ready to be saved.
+        """
         valid_styles = {
             #'dudedb': self.__draw_ubl_style, # need revision
-            #'ptp': self.__draw_ubl_style, # need revision
+            'ubl': self.__draw_ubl_style,
+            'ptp': self.__draw_ubl_style,
+            'pfsmsff': self.__draw_db_style,
+            'unk_domains': self.__draw_unk_style,
+            'gen': self.__draw_gen_style,
             'episcan': self.__draw_gen_style,
             }
 
+        assert backend in ('matplotlib', 'svg-native', 'raster'), "backend '{0}' not one of 'matplotlib', 'svg-native', 'raster'".format(backend)
+        assert thumb or backend != 'raster', "backend='raster' only draws thumbnails"
         assert style in valid_styles, '{0} style not in valid_styles ({1})'.format(style, valid_styles)
 
+        if fixed is None:
+            fixed = self.fixed
+        p = layout_params(item["len"], self.max_len, fixed, thumb)
+
+        if backend in ('svg-native', 'raster'):
+            return self.__native_canvas(item, style, p, thumb, backend, fixed)
+
         if thumb:
-            p = {"pad1": item["len"] * 0.02,
-                "pad2": item["len"] * 0.003,
-                "figsize": (1.5, 0.3),
-                "lpad": 0.16,
-                "evpad": 0.5,
-                "nvpad": 0.4}
+            context = self.__render_context("thumb", p["figsize"])
         else:
-            if not self.fixed:
-                p = {"pad1": self.max_len * 0.035, # pad out 1% of the figure left and right
-                    "pad2": self.max_len * 0.003,
-                    "figsize": (25, 1),
-                    "lpad": 0.02, # vertical size of the central line
-                    "evpad": 0.25, # vertical size of the 'normal' rectangle domain boxes.
-                    "nvpad": 0.2,
-                    "titlepos": "left",
-                    "titlesize": 13} # vertical size of the 'enhanced' rectangle domain boxes.
-            else: # ie fixed
-                p = {"pad1":  item["len"] * 0.03, # pad out 1% of the figure left and right
-                    "pad2": item["len"] * 0.003,
-                    "figsize": (7, 1),
-                    "lpad": 0.02, # vertical size of the central line
-                    "evpad": 0.20, # vertical size of the 'normal' rectangle domain boxes.
-                    "nvpad": 0.2,
-                    "titlesize": 13
-                    } # vertical size of the 'enhanced' rectangle domain boxes.
-
-
-        fig = plt.figure(figsize=p["figsize"])
-
-        ax = fig.add_subplot(211)
-        axlab = fig.add_subplot(212)
-
-        ax.set_position([0, 0.5, 1.0, 0.5])
-        axlab.set_position([0, 0.0, 1.0, 0.60])
+            context = self.__render_context("fixed" if fixed else "scaled", p["figsize"])
+        ax, axlab = context.ax, context.axlab
+        from matplotlib.patches import Rectangle
 
         ax.add_patch(Rectangle((0,-p["lpad"]), item["len"]-1, p["lpad"]*2, ec="none", fc="black", color="black")) # The line for the protein
 
-        if self.fixed:
-            ax.set_xlim([-p["pad1"], item["len"]+p["pad1"]])
-            axlab.set_xlim([-p["pad1"], item["len"]+p["pad1"]])
-        else:
-            ax.set_xlim([-p["pad1"], self.max_len+p["pad1"]])
-            axlab.set_xlim([-p["pad1"], item["len"]+p["pad1"]])
+        xlim, labxlim = self.__xlims(item, p, fixed)
+        ax.set_xlim(xlim)
+        axlab.set_xlim(labxlim)
+
+        ax.set_ylim(AX_YLIM)
+        axlab.set_ylim(AXLAB_YLIM)
+
+        if len(item["domains"]) > 0:
+            valid_styles[style](ax, axlab, item, p, thumb)
+
+        if not thumb: # numbers showing the aa position of peptide
+            tpad = p['pad1']/10
+            ax.text(-tpad, 0, str(0), ha="right", va="center", fontsize=5, color="black", zorder=100001)
+            ax.text(item["len"]+tpad, 0, item['len'], ha="left", va="center", fontsize=5, color="black", zorder=100001)
+
+        return context
 
-        ax.set_ylim([-1, 1])
+    def __xlims(self, item, p, fixed):
+        """
+        x limits of the domain and label axes
+        """
+        return xlims(item["len"], self.max_len, fixed, p)
 
-        axlab.set_ylim([0, 10])
-        axlab.set_facecolor('none')
+    def __native_canvas(self, item, style, p, thumb=False, backend='svg-native', fixed=True):
+        """
+        The 'svg-native' and 'raster' backends of draw(). Same layout as the matplotlib path.
+        """
+        valid_styles = {
+            'ubl': self.__native_ubl_style,
+            'ptp': self.__native_ubl_style,
+            'gen': self.__native_gen_style,
+            'episcan': self.__native_gen_style,
+            }
+        assert style in valid_styles, "{0} style not available with backend='{1}' ({2})".format(style, backend, list(valid_styles))
+
+        xlim, labxlim = self.__xlims(item, p, fixed)
+        if backend == 'raster':
+            canvas = raster_canvas(p["figsize"])
+        else:
+            canvas = svg_canvas(p["figsize"])
+        ax = canvas.axes(AX_POSITION, xlim, AX_YLIM)
+        axlab = canvas.axes(AXLAB_POSITION, labxlim, AXLAB_YLIM)
+
+        ax.rect(0, -p["lpad"], item["len"]-1, p["lpad"]*2, fc="black") # The line for the protein
 
         if len(item["domains"]) > 0:
             valid_styles[style](ax, axlab, item, p, thumb)
@@ -265,64 +1083,79 @@ class schematic:
             ax.text(-tpad, 0, str(0), ha="right", va="center", fontsize=5, color="black", zorder=100001)
             ax.text(item["len"]+tpad, 0, item['len'], ha="left", va="center", fontsize=5, color="black", zorder=100001)
 
-        ax.set_xticklabels("")
-        ax.set_yticklabels("")
-        ax.set_ylabel("")
-        ax.set_xlabel("")
-        ax.tick_params(left=None, top=None, bottom=None, right=None)
-        ax.set_frame_on(False)
+        return canvas
+
+    def __render_context(self, key, figsize):
+        """
+        Get the (reused) render_context for this parameter set
+        """
+        if key not in self.render_contexts:
+            self.render_contexts[key] = render_context(figsize)
+        return self.render_contexts[key]
+
+    def close(self):
+        """
+        **Purpose**
+            Free up the figures draw() keeps for reuse
+        """
+        for context in self.render_contexts.values():
+            context.close()
+        self.render_contexts = {}
+
+    def __ubl_colour(self, item, d):
+        """
+        colour and label of a FAMILY-DEFINING domain in the ubl style
+        """
+        # special code to convert RING finger -> RNF finger
+        item["type"] = item["type"].replace("RING finger", "RNF finger")
 
-        axlab.set_xticklabels("")
-        axlab.set_yticklabels("")
-        axlab.set_ylabel("")
-        axlab.set_xlabel("")
-        axlab.tick_params(left=None, top=None, bottom=None, right=None)
-        axlab.set_frame_on(False)
+        if item["type"] in self.col_map:
+            return self.col_map[item["type"]], item["type"]
+        elif d["db"] in domain_label_lookup and domain_label_lookup[d["db"]] in self.col_map: # This is where mixed domains will end up.
+            return self.col_map[domain_label_lookup[d["db"]]], domain_label_lookup[d["db"]]
+        elif d["name"] in self.col_map:
+            return self.col_map[d["name"]], d["name"]
 
-        fig.savefig(filename)
-        plt.close(fig) # Free up the memory
+        print("Warning: '%s' not found in colour map" % d["db"])
+        return "pink", d["db"]
 
-    def __draw_ubl_style(self, ax, item, p, thumb=False):
+    def __draw_ubl_style(self, ax, axlab, item, p, thumb=False):
         """
         drawing style for the ubiquitin ligase database
         """
+        # The boxes are gathered into two layers, grey below and FAMILY-DEFINING on top,
+        # and each layer is drawn as a single collection.
+        fam_boxes = ([], [], []) # left, right, colour
+        other_boxes = ([], [])
         low_labs = []
         for d in item["domains"]:
-            if d["fam"] == "FAMILY-DEFINING":
-                # special code to convert RING finger -> RNF finger
-                item["type"] = item["type"].replace("RING finger", "RNF finger")
-
-                if item["type"] in self.col_map:
-                    col = self.col_map[item["type"]]
-                    label = item["type"]
-                elif d["db"] in domain_label_lookup and domain_label_lookup[d["db"]] in self.col_map: # This is where mixed domains will end up.
-                    col = self.col_map[domain_label_lookup[d["db"]]]
-                    label = domain_label_lookup[d["db"]]
-                elif d["name"] in self.col_map:
-                    col = self.col_map[d["name"]]
-                    label = d["name"]
-                else:
-                    print("Warning: '%s' not found in colour map" % d["db"])
-                    col = "pink"
-                    label = d["db"]
-
-                ax.add_patch(Rectangle((d["pos"][0], -p["evpad"]), d["pos"][1] - d["pos"][0], p["evpad"]*2,
-                    ec="none", fc=col, lw=0.5, zorder=100000))
+            if d.get("fam") == "FAMILY-DEFINING":
+                col, label = self.__ubl_colour(item, d)
+                fam_boxes[0].append(d["pos"][0])
+                fam_boxes[1].append(d["pos"][1])
+                fam_boxes[2].append(col)
 
                 if not thumb: # numbers showing the aa position of the domain
                     ax.text(d["pos"][0]+p["pad2"], 0, str(d["pos"][0]+1), ha="left", va="center", fontsize=5, color="black", zorder=100001)
                     ax.text(d["pos"][1]-p["pad2"], 0, str(d["pos"][1]+1), ha="right", va="center", fontsize=5, color="black", zorder=100001)
             else:
-                ax.add_patch(Rectangle((d["pos"][0], -p["nvpad"]), d["pos"][1] - d["pos"][0], p["nvpad"]*2,
-                    ec="none", fc="grey", lw=0.5, zorder=2))
+                other_boxes[0].append(d["pos"][0])
+                other_boxes[1].append(d["pos"][1])
 
             if not thumb:
-                if d["fam"] == "FAMILY-DEFINING":
+                if d.get("fam") == "FAMILY-DEFINING":
                     l = {"p": (d["pos"][0] + d["pos"][1])/2, "lab": str(label), "fs": 9, "col": "black"}
                 else:
                     l = {"p": (d["pos"][0] + d["pos"][1])/2, "lab": str(d["name"]), "fs": 6, "col": "grey"}
                 low_labs.append(l)
 
+        if other_boxes[0]:
+            ax.add_collection(_box_collection(other_boxes[0], other_boxes[1], -p["nvpad"], p["nvpad"],
+                edgecolors="none", facecolors="grey", linewidths=0.5, zorder=2), autolim=False)
+        if fam_boxes[0]:
+            ax.add_collection(_box_collection(fam_boxes[0], fam_boxes[1], -p["evpad"], p["evpad"],
+                edgecolors="none", facecolors=fam_boxes[2], linewidths=0.5, zorder=100000), autolim=False)
+
         # sort out colliding labels:
         for l in low_labs:
             ax.text(l["p"], -0.5, l["lab"], ha="center", va="center", fontsize=l["fs"], color=l["col"])
@@ -330,29 +1163,39 @@ class schematic:
         if not thumb: # the title
             ax.text(item["len"]/2, 0.7, "%s (%s)" % (item["name"], item["type"]), color="black", fontsize=p["titlesize"], ha="center")
 
-    def __draw_db_style(self, ax, item, p, thumb=False):
+    def __db_colour(self, d):
+        """
+        colour of a domain in the pfsmsff style, from the db it came from
+        """
+        if "SSF" in d["db"]:
+            return self.col_map["SUPERFAMILY"]
+        elif "PF" in d["db"]:
+            return self.col_map["Pfam-A"]
+        elif "SM" in d["db"]:
+            return self.col_map["SMART"]
+
+        print("Warning: '%s' not found in colour map" % d["db"]) # e.g. Gene3D, PANTHER, PROSITE from InterProScan
+        return "pink"
+
+    def __draw_db_style(self, ax, axlab, item, p, thumb=False):
         """
         a more generic style of drawing. This one colours the domain depending upon which
         db it came from
         """
-        for d in item["domains"]:
-            if "SSF" in d["db"]:
-                type = "SUPERFAMILY"
-            elif "PF" in d["db"]:
-                type = "Pfam-A"
-            elif "SM" in d["db"]:
-                type = "SMART"
-            else:
-                print("Warning: '%s' not found in colour map" % d["db"])
+        from matplotlib.patches import Rectangle
+        from .adjustText import adjust_text
 
+        texts = []
+        for d in item["domains"]:
             ax.add_patch(Rectangle((d["pos"][0], -0.25), d["pos"][1] - d["pos"][0], 0.5,
-                ec="black", fc=self.col_map[type], lw=0.5))
-            t = ax.text((d["pos"][0] + d["pos"][1])/2, -0.5, str(d["name"]), ha="center", va="center", fontsize=6, color="black")
-            texts.append(t)
-
-        adjust_text(texts, arrowprops=dict(arrowstyle="-", color='k', lw=0.5))
+                ec="black", fc=self.__db_colour(d), lw=0.5))
+            if not thumb:
+                t = ax.text((d["pos"][0] + d["pos"][1])/2, -0.5, str(d["name"]), ha="center", va="center", fontsize=6, color="black")
+                texts.append(t)
 
-        ax.text(item["len"]/2, 0.7, "ID: {0}".format(item["name"]), color="black", fontsize=p["titlesize"], ha="center")
+        if not thumb:
+            adjust_text(texts, ax=ax, draggable=False, arrowprops=dict(arrowstyle="-", color='k', lw=0.5))
+            ax.text(item["len"]/2, 0.7, "ID: {0}".format(item["name"]), color="black", fontsize=p["titlesize"], ha="center")
 
     def __draw_gen_style(self, ax, axlab, item, p, thumb=False):
         """
@@ -362,22 +1205,28 @@ class schematic:
         """
         texts = []
 
-        for d in item["domains"]:
-            ax.add_patch(Rectangle((
-                d["pos"][0], -0.25), d["pos"][1] - d["pos"][0], 0.5,
-                ec="lightgrey",
-                fc='grey', # self.col_map[d["name"]],
-                lw=0.5))
+        ax.add_collection(_box_collection([d["pos"][0] for d in item["domains"]], [d["pos"][1] for d in item["domains"]], -0.25, 0.25,
+            edgecolors="lightgrey",
+            facecolors='grey', # self.col_map[d["name"]],
+            linewidths=0.5), autolim=False)
 
+        for d in item["domains"]:
             if not thumb:
-                r = random.randint(0, 10) / 10 # Give adjust_text something to work with
-                t = axlab.text((d["pos"][0] + d["pos"][1])/2, 9-r, str(d["name"]), ha="center", va="center", fontsize=6, color="black")
+                y = LABEL_Y
+                if self.label_layout == 'adjust':
+                    y -= random.randint(0, 10) / 10 # Give adjust_text something to work with
+                t = axlab.text((d["pos"][0] + d["pos"][1])/2, y, str(d["name"]), ha="center", va="center", fontsize=6, color="black")
                 texts.append(t)
 
             if not thumb: # numbers showing the aa position of the domain
                 ax.text(d["pos"][0]+p["pad2"], 0.4, str(d["pos"][0]+1), ha="center", va="center", fontsize=5, color="black", zorder=100001)
                 ax.text(d["pos"][1]-p["pad2"], 0.4, str(d["pos"][1]+1), ha="center", va="center", fontsize=5, color="black", zorder=100001)
 
+        if self.label_layout == 'tiers':
+            self.__tier_labels(axlab, texts)
+            return
+
+        from .adjustText import adjust_text
         adjust_text(texts,
             ax=axlab,
             #arrowprops=dict(arrowstyle="-", color='k', lw=0.5),
@@ -385,22 +1234,81 @@ class schematic:
             autoalign='y',
             text_from_points=False,
             force_text=0.2,
+            draggable=False, # the figure is reused, see render_context
             ha="center",
             va="center"
             )
 
-    def __draw_unk_style(self, ax, item, p, thumb=False):
+    def __tier_labels(self, axlab, texts):
+        """
+        label_layout='tiers': measure the labels once, and stack them into rows with label_tiers()
+        """
+        if not texts:
+            return
+        renderer = axlab.figure.canvas.get_renderer()
+        to_data = axlab.transData.inverted()
+        extents = [to_data.transform(t.get_window_extent(renderer).get_points()) for t in texts] # [[x0, y0], [x1, y1]]
+        height = max(e[1][1] - e[0][1] for e in extents)
+        ys = label_tiers([e[0][0] for e in extents], [e[1][0] for e in extents], height)
+        for t, y in zip(texts, ys):
+            t.set_y(y)
+
+    def __native_ubl_style(self, ax, axlab, item, p, thumb=False):
+        """
+        __draw_ubl_style for the 'svg-native' and 'raster' backends
+        """
+        for d in item["domains"]:
+            if d.get("fam") == "FAMILY-DEFINING":
+                col, label = self.__ubl_colour(item, d)
+                ax.rect(d["pos"][0], -p["evpad"], d["pos"][1] - d["pos"][0], p["evpad"]*2, fc=col, zorder=100000)
+
+                if not thumb: # numbers showing the aa position of the domain
+                    ax.text(d["pos"][0]+p["pad2"], 0, str(d["pos"][0]+1), ha="left", va="center", fontsize=5, color="black", zorder=100001)
+                    ax.text(d["pos"][1]-p["pad2"], 0, str(d["pos"][1]+1), ha="right", va="center", fontsize=5, color="black", zorder=100001)
+                    ax.text((d["pos"][0] + d["pos"][1])/2, -0.5, str(label), ha="center", va="center", fontsize=9, color="black")
+            else:
+                ax.rect(d["pos"][0], -p["nvpad"], d["pos"][1] - d["pos"][0], p["nvpad"]*2, fc="grey", zorder=2)
+                if not thumb:
+                    ax.text((d["pos"][0] + d["pos"][1])/2, -0.5, str(d["name"]), ha="center", va="center", fontsize=6, color="grey")
+
+        if not thumb: # the title
+            ax.text(item["len"]/2, 0.7, "%s (%s)" % (item["name"], item["type"]), color="black", fontsize=p["titlesize"], ha="center")
+
+    def __native_gen_style(self, ax, axlab, item, p, thumb=False):
+        """
+        __draw_gen_style for the 'svg-native' and 'raster' backends.
+        Labels that would collide are stacked into rows below each other,
+        as label_layout='tiers', instead of being moved by adjust_text.
+        """
+        if not thumb:
+            mids = [(d["pos"][0] + d["pos"][1])/2 for d in item["domains"]]
+            halves = [axlab.text_width(str(d["name"]), 6) / 2 for d in item["domains"]]
+            ys = label_tiers([m - h for m, h in zip(mids, halves)], [m + h for m, h in zip(mids, halves)], axlab.text_height(6))
+
+        for i, d in enumerate(item["domains"]):
+            ax.rect(d["pos"][0], -0.25, d["pos"][1] - d["pos"][0], 0.5, fc="grey", ec="lightgrey", lw=0.5)
+
+            if not thumb:
+                axlab.text(mids[i], ys[i], str(d["name"]), ha="center", va="center", fontsize=6, color="black")
+
+                # numbers showing the aa position of the domain
+                ax.text(d["pos"][0]+p["pad2"], 0.4, str(d["pos"][0]+1), ha="center", va="center", fontsize=5, color="black", zorder=100001)
+                ax.text(d["pos"][1]-p["pad2"], 0.4, str(d["pos"][1]+1), ha="center", va="center", fontsize=5, color="black", zorder=100001)
+
+    def __draw_unk_style(self, ax, axlab, item, p, thumb=False):
         """
         This is the drawing style for the domains in the CD4+
         T cell paper figure.
         """
+        boxes = ([], [], []) # left, right, colour
         a = True
         for i, d in enumerate(item["domains"]):
             if d["name"] not in self.col_map:
                 print("Warning: '%s' not found in colour map" % d["name"])
             else:
-                ax.add_patch(Rectangle((d["pos"][0], -0.25), d["pos"][1] - d["pos"][0], 0.5,
-                    ec="none", fc=self.col_map[d["name"]], lw=0.5))
+                boxes[0].append(d["pos"][0])
+                boxes[1].append(d["pos"][1])
+                boxes[2].append(self.col_map[d["name"]])
 
             if a:
                 ax.text((d["pos"][0] + d["pos"][1])/2, -0.5, str(d["name"]), ha="center", va="center", fontsize=6, color="black")
@@ -410,6 +1318,10 @@ class schematic:
 
             #ax.text((d["pos"][0] + d["pos"][1])/2, -0.7, str(d["db"]), ha="center", va="center", fontsize=6, color="black")
 
+        if boxes[0]:
+            ax.add_collection(_box_collection(boxes[0], boxes[1], -0.25, 0.25,
+                edgecolors="none", facecolors=boxes[2], linewidths=0.5), autolim=False)
+
         ax.text(0, 0.5, "%s (%s amino acids)" % (item["name"],  item["len"]), color="black", fontsize=20, ha="left")
 
 if __name__ == "__main__":
@@ -426,21 +1338,63 @@ if __name__ == "__main__":
     parser.add_option("-f", "--fixed",
         dest="fixed", action="store_true", default=False,
         help="draw the protein 0 -- 100% (True) or (False) all scaled so that the proteins can be compared in size")
+    parser.add_option("--format", default="fasta_style",
+        dest="format", choices=["fasta_style", "dfam", "interproscan_tsv", "gff3"],
+        help="the input format: fasta_style (default), dfam, interproscan_tsv or gff3, see schematic.parse_file()")
+    parser.add_option("-l", "--labels", default="adjust",
+        dest="label_layout", choices=["adjust", "tiers"],
+        help="how the gen style keeps domain labels apart: 'adjust' (default) or 'tiers', faster and reproducible")
     parser.add_option("-v", "--svg",
         dest="svg", action="store_true", default=False,
         help="output 'full' figures as svg files")
+    parser.add_option("-w", "--workers", type="int",
+        dest="workers", default=None,
+        help="number of processes to draw with")
+    parser.add_option("-a", "--atlas", default=False,
+        dest="atlas", action="store_true",
+        help="pack the thumbnails into sheet images with a JSON index (thumbs/atlas.json), rather than one file each")
+    parser.add_option("-n", "--incremental", default=False,
+        dest="incremental", action="store_true",
+        help="only redraw the proteins that changed since the last --incremental run")
+    parser.add_option("-b", "--bundle", default=None,
+        dest="bundle",
+        help="write the full and thumbs images into one .tar, .zip or .ddb (key-value bundle) file, rather than as files under -o")
+    parser.add_option("--socket", default="domain_draw.sock",
+        dest="socket",
+        help="Unix socket for 'serve' mode to listen on")
     parser.add_option("-c", "--collate", default=False,
         dest="collate", action="store_true",
         help="Scan the domain data and list the FAMILY-DEFINING domains")
 
     (options, args) = parser.parse_args()
 
-    if options.collate:
+    if args and args[0] == "serve":
+        # Stay running, and draw the items sent to the socket, see server.py
+        from .server import serve
+        serve(options.socket, workers=options.workers)
+    elif options.collate:
         # scan the file and collect all of the FAMILY-DEFINING categories.
         collate_family_defining(options.filename)
+    elif options.bundle:
+        # As below, but the images are named full/<name> and thumbs/<name> inside the bundle
+        t = schematic(fixed=options.fixed, svg=options.svg, label_layout=options.label_layout)
+        t.parse_file(options.filename, format=options.format, fixed=options.fixed, pdf=False)
+        t.output_path = "full"
+        with open_sink(options.bundle) as sink:
+            t.draw_all(style=options.style, thumbs="both", thumb_path="thumbs", workers=options.workers, sink=sink)
     else:
-        t = schematic(options.filename, output_path=os.path.join(options.output_path, "full"), fixed=options.fixed, svg=options.svg)
-        t.draw_all(style=options.style, thumbs=False)
-
-        t = schematic(options.filename, output_path=os.path.join(options.output_path, "thumbs"))
-        t.draw_all(style=options.style, thumbs=True)
+        full_path = os.path.join(options.output_path, "full")
+        thumb_path = os.path.join(options.output_path, "thumbs")
+        for path in (full_path, thumb_path):
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        # Parse once, and draw the full image and the thumbnail of each item in the same pass.
+        # Thumbnails are always fixed length, as with -f
+        t = schematic(fixed=options.fixed, svg=options.svg, label_layout=options.label_layout)
+        t.parse_file(options.filename, format=options.format, output_path=full_path, fixed=options.fixed, pdf=False)
+        if options.atlas:
+            t.draw_all(style=options.style, workers=options.workers, incremental=options.incremental)
+            t.draw_atlas(style=options.style, path=thumb_path, fixed=True)
+        else:
+            t.draw_all(style=options.style, thumbs="both", thumb_path=thumb_path, workers=options.workers, incremental=options.incremental)
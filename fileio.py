@@ -0,0 +1,333 @@
+"""
+
+Open (possibly compressed) domain files
+
+Compression is detected from the magic bytes, not the file extension.
+Supported: plain text, gzip, BGZF (blocked gzip, as made by bgzip), xz and zstd.
+zstd needs the optional 'zstandard' package.
+
+"""
+
+import os, io, gzip, lzma, struct, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def detect_compression(filename):
+    """
+    **Purpose**
+        Sniff the magic bytes at the start of filename
+
+    **Returns**
+        One of 'bgzf', 'gzip', 'xz', 'zstd' or None for an uncompressed file
+    """
+    with open(filename, 'rb') as fh:
+        header = fh.read(18)
+
+    if header[:2] == GZIP_MAGIC:
+        if _is_bgzf_header(header):
+            return 'bgzf'
+        return 'gzip'
+    elif header[:6] == XZ_MAGIC:
+        return 'xz'
+    elif header[:4] == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+def _is_bgzf_header(header):
+    # gzip, deflate, FEXTRA set and a 'BC' extra subfield, see the SAM spec.
+    return (len(header) >= 16 and header[2] == 8 and header[3] & 4
+        and header[12:14] == b'BC')
+
+def open_domain_file(filename, threads=None, binary=False):
+    """
+    **Purpose**
+        Open filename for reading as text, transparently decompressing it.
+
+    **Arguments**
+        filename
+            filename to open
+
+        threads (Optional, default=None)
+            Number of threads used to inflate BGZF files. None uses all cores.
+            Ordinary gzip, xz and zstd streams cannot be split, and are always
+            inflated on a single thread.
+
+        binary (Optional, default=False)
+            return a binary file handle, reading (decompressed) bytes
+
+    **Returns**
+        A text mode file handle, or a binary one
+    """
+    compression = detect_compression(filename)
+
+    if compression == 'bgzf':
+        raw = bgzf_reader(filename, threads=threads)
+        fh = io.BufferedReader(raw, buffer_size=1 << 20)
+    elif compression == 'gzip':
+        fh = gzip.open(filename, 'rb')
+    elif compression == 'xz':
+        fh = lzma.open(filename, 'rb')
+    elif compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('{0} is zstd compressed, reading it needs the zstandard package'.format(filename))
+        fh = zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+    else:
+        return open(filename, 'rb' if binary else 'rt')
+    return fh if binary else io.TextIOWrapper(fh)
+
+def iter_bgzf_blocks(fh):
+    """
+    **Purpose**
+        Split a BGZF stream into its blocks, without inflating them
+
+    **Returns**
+        A generator of (<raw deflate data>, <crc32>, <uncompressed size>)
+    """
+    while True:
+        header = fh.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4:
+            raise IOError('Truncated or corrupt BGZF block')
+
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = fh.read(xlen)
+
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack('<H', extra[i+2:i+4])[0]
+            if extra[i:i+2] == b'BC':
+                bsize = struct.unpack('<H', extra[i+4:i+6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise IOError('gzip block without a BGZF size field')
+
+        body = fh.read(bsize + 1 - 12 - xlen) # total block size is BSIZE+1
+        crc, isize = struct.unpack('<II', body[-8:])
+        yield body[:-8], crc, isize
+
+def _inflate_block(block):
+    # zlib releases the GIL, so blocks can inflate in parallel on threads.
+    cdata, crc, isize = block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise IOError('BGZF block failed its CRC check')
+    return data
+
+class bgzf_reader(io.RawIOBase):
+    """
+    Read-only, sequential raw stream over a BGZF file.
+
+    Blocks are inflated by a thread pool a few blocks ahead of the reader,
+    and handed back in file order.
+    """
+    def __init__(self, filename, threads=None):
+        self.fh = open(filename, 'rb')
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.blocks = iter_bgzf_blocks(self.fh)
+        self.pending = deque()
+        self.buffer = b''
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def __fill(self):
+        while len(self.pending) < self.threads * 4:
+            block = next(self.blocks, None)
+            if block is None:
+                return
+            self.pending.append(self.pool.submit(_inflate_block, block))
+
+    def readinto(self, b):
+        while self.pos >= len(self.buffer):
+            self.__fill()
+            if not self.pending:
+                return 0 # EOF
+            self.buffer = self.pending.popleft().result()
+            self.pos = 0
+
+        n = min(len(b), len(self.buffer) - self.pos)
+        b[:n] = self.buffer[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for f in self.pending:
+                f.cancel()
+            self.pool.shutdown(wait=True)
+            self.fh.close()
+        super().close()
+
+def iter_text_blocks(oh, block_size=1 << 22):
+    """
+    **Purpose**
+        Read an open text (or binary) file in blocks of roughly block_size
+        characters (or bytes), each ending on a line boundary
+
+    **Returns**
+        A generator of strings (or bytes)
+    """
+    carry = None
+    while True:
+        block = oh.read(block_size)
+        if carry is None:
+            carry = block[:0]
+            newline = '\n' if isinstance(block, str) else b'\n'
+        if not block:
+            if carry:
+                yield carry if carry.endswith(newline) else carry + newline
+            return
+        block = carry + block
+        cut = block.rfind(newline) + 1
+        if cut == 0: # a single very long line
+            carry = block
+            continue
+        carry = block[cut:]
+        yield block[:cut]
+
+FIELD_PAD = 64 # zero bytes either side of a tab_fields() buffer
+
+def tab_fields(block, ncols):
+    """
+    **Purpose**
+        Find the fields of a block of tab separated lines, all at once.
+        Every line must end with a newline.
+
+    **Arguments**
+        block
+            the lines, as bytes
+
+        ncols
+            the number of fields each line must have
+
+    **Returns**
+        (<buffer>, <starts>, <ends>): the block as a uint8 array, and two (<lines>, ncols)
+        arrays of the offset of the start, and end (exclusive), of each field in the buffer.
+        Or None if any line does not have ncols fields.
+        The buffer is padded with FIELD_PAD zero bytes at each end.
+    """
+    pad = bytes(FIELD_PAD)
+    buf = numpy.frombuffer(pad + block + pad, dtype=numpy.uint8)
+    seps = numpy.flatnonzero(buf <= 10) # tabs, newlines, and the padding
+    seps = seps[FIELD_PAD:len(seps)-FIELD_PAD]
+    nrows = numpy.count_nonzero(buf == 10)
+    if len(seps) != nrows * ncols or numpy.count_nonzero(buf == 9) != nrows * (ncols-1):
+        return None
+    ends = seps.reshape(-1, ncols)
+    if not (buf[ends[:, -1]] == 10).all(): # every line ends on its ncols'th separator
+        return None
+    # each field starts just after the separator before it
+    starts = numpy.concatenate(([FIELD_PAD - 1], seps[:-1])).reshape(-1, ncols) + 1
+    return buf, starts, ends
+
+def _field_rows(buf, offsets, width):
+    # Copy buf[offset:offset+width] for each offset into a (<offsets>, width) matrix
+    if width > FIELD_PAD:
+        buf = numpy.concatenate((buf, numpy.zeros(width, dtype=numpy.uint8)))
+    return numpy.lib.stride_tricks.sliding_window_view(buf, width)[offsets]
+
+def int_fields(buf, starts, ends):
+    """
+    **Purpose**
+        Convert a column of tab_fields() holding unsigned integers, without
+        making a Python object per field
+
+    **Returns**
+        An int64 array. Raises ValueError if a field is empty or not all digits.
+    """
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    width = int(lengths.max())
+    if width > 18 or lengths.min() == 0:
+        raise ValueError('integer field is empty or too long')
+    # Right align the digits in a (<fields>, width) matrix, padded with zeros
+    digits = _field_rows(buf, ends - width, width) - numpy.uint8(48) # non-digits wrap round to > 9
+    digits *= numpy.arange(width - 1, -1, -1) < lengths[:, None]
+    if (digits > 9).any():
+        raise ValueError('integer field is not all digits')
+    # Up to 15 digits are exact in a float64 dot product, which is much faster than an int64 one
+    if width <= 15:
+        return (digits @ (10.0 ** numpy.arange(width - 1, -1, -1))).astype(numpy.int64)
+    return digits.astype(numpy.int64) @ (10 ** numpy.arange(width - 1, -1, -1, dtype=numpy.int64))
+
+def intern_fields(buf, starts, ends):
+    """
+    **Purpose**
+        Intern a column of tab_fields() holding strings, in NumPy, so only the
+        distinct strings become Python objects
+
+    **Returns**
+        (<ids>, <vocab>): an int32 array of ids into vocab, the distinct strings
+        in order of first appearance
+    """
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return numpy.zeros(0, dtype=numpy.int32), []
+    # The fields as rows of a zero padded (<fields>, width) byte matrix, width a multiple of 8
+    width = max(-(-int(lengths.max()) // 8) * 8, 8)
+    chars = _field_rows(buf, starts, width)
+    chars *= numpy.arange(width) < lengths[:, None]
+    words = chars.view(numpy.uint64)
+
+    # Hash each row to one uint64, and find the distinct hashes. Tables are usually
+    # sorted by sequence, so only the first row of each run of repeats is looked at.
+    h = words[:, 0].copy()
+    for i in range(1, words.shape[1]):
+        h = (h * numpy.uint64(0x100000001B3)) ^ words[:, i]
+    run_starts = numpy.concatenate(([0], numpy.flatnonzero(h[1:] != h[:-1]) + 1))
+    distinct, first, inverse = numpy.unique(h[run_starts], return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    rank = numpy.empty(len(order), dtype=numpy.int32)
+    rank[order] = numpy.arange(len(order), dtype=numpy.int32)
+    ids = numpy.repeat(rank[inverse.ravel()], numpy.diff(numpy.append(run_starts, len(h))))
+
+    rows = run_starts[first[order]] # the first row with each distinct string, in vocab order
+    if not (words == words[rows][ids]).all(): # two strings share a hash, sort the strings themselves
+        keys = chars.view('S{0}'.format(width)).ravel()
+        distinct, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+        order = numpy.argsort(first)
+        rank = numpy.empty(len(order), dtype=numpy.int32)
+        rank[order] = numpy.arange(len(order), dtype=numpy.int32)
+        ids = rank[inverse.ravel()]
+        rows = first[order]
+    return ids, [v.decode('utf-8') for v in chars[rows].view('S{0}'.format(width)).ravel().tolist()]
+
+def split_at_records(filename, nchunks):
+    """
+    **Purpose**
+        Cut an uncompressed 'fasta_style' file into about nchunks byte ranges,
+        each starting on a '>' header line, so the ranges can be parsed independently.
+
+    **Returns**
+        A list of (start, end) byte offsets, in file order
+    """
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as fh:
+        for i in range(1, nchunks):
+            fh.seek(max(size * i // nchunks, starts[-1]))
+            fh.readline() # skip the (probably partial) current line
+            while True:
+                offset = fh.tell()
+                line = fh.readline()
+                if not line:
+                    offset = size
+                    break
+                if b'>' in line: # Same header test as parse_fasta_style_lines()
+                    break
+            if offset > starts[-1] and offset < size:
+                starts.append(offset)
+    return list(zip(starts, starts[1:] + [size]))
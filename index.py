@@ -0,0 +1,111 @@
+"""
+
+faidx-style offset index for 'fasta_style' domain files
+
+The index is a tab separated file, <filename>.ddi, one line per protein:
+    <name>  <byte offset of the '>' header>  <length of the record in bytes>  <length of the protein>
+
+The first line is a '#' comment recording the index version, and the size and
+mtime of the source file, so a stale index is rebuilt rather than used.
+
+"""
+
+import os
+
+from .fileio import detect_compression
+
+INDEX_VERSION = 2
+
+def index_filename_for(filename):
+    return '{0}.ddi'.format(filename)
+
+def build_index(filename, index_filename=None):
+    """
+    **Purpose**
+        Scan filename once and write the offset index
+
+    **Arguments**
+        filename
+            An uncompressed 'fasta_style' domain file
+
+        index_filename (Optional, default=<filename>.ddi)
+            where to write the index
+
+    **Returns**
+        The index, a dictionary of {<name>: (<offset>, <length>, <protein length>)}
+    """
+    assert detect_compression(filename) is None, '{0} is compressed, random access needs an uncompressed file'.format(filename)
+    if not index_filename:
+        index_filename = index_filename_for(filename)
+
+    def protein_len(line):
+        # As parse_fasta_style_lines(), the length is the second column of the last domain line
+        try:
+            return int(line.split()[1])
+        except (AttributeError, IndexError, ValueError):
+            return 1
+
+    index = {}
+    name = None
+    last = None # last domain line of the current record
+    start = 0
+    offset = 0
+    with open(filename, 'rb') as fh:
+        for line in fh:
+            if b'>' in line: # Same header test as schematic.iter_records()
+                if name is not None:
+                    index[name] = (start, offset - start, protein_len(last))
+                name = line.split()[0].replace(b'>', b'').decode('utf-8')
+                start = offset
+                last = None
+            elif line.strip():
+                last = line
+            offset += len(line)
+    if name is not None:
+        index[name] = (start, offset - start, protein_len(last))
+
+    st = os.stat(filename)
+    tmp_filename = '{0}.tmp{1}'.format(index_filename, os.getpid())
+    with open(tmp_filename, 'wt') as oh:
+        oh.write('#ddi\t{0}\t{1}\t{2}\n'.format(INDEX_VERSION, st.st_size, st.st_mtime_ns))
+        for name, (start, length, protein_len) in index.items():
+            oh.write('{0}\t{1}\t{2}\t{3}\n'.format(name, start, length, protein_len))
+    os.replace(tmp_filename, index_filename)
+    return index
+
+def load_index(filename, index_filename=None):
+    """
+    **Purpose**
+        Load the offset index for filename, building it first if it is missing or stale.
+
+    **Returns**
+        The index, a dictionary of {<name>: (<offset>, <length>, <protein length>)}
+    """
+    if not index_filename:
+        index_filename = index_filename_for(filename)
+    if not os.path.exists(index_filename):
+        return build_index(filename, index_filename)
+
+    st = os.stat(filename)
+    index = {}
+    with open(index_filename, 'rt') as oh:
+        header = oh.readline().rstrip('\n').split('\t')
+        if header != ['#ddi', str(INDEX_VERSION), str(st.st_size), str(st.st_mtime_ns)]:
+            return build_index(filename, index_filename) # stale, or an older index version
+        for line in oh:
+            name, start, length, protein_len = line.rstrip('\n').split('\t')
+            index[name] = (int(start), int(length), int(protein_len))
+    return index
+
+def read_record(filename, index, name):
+    """
+    **Purpose**
+        Seek to and read the raw text of a single protein record
+
+    **Returns**
+        The record text, header line included
+    """
+    start, length = index[name][:2]
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        return fh.read(length).decode('utf-8')
@@ -0,0 +1,403 @@
+"""
+
+Layout of schematics: the geometry schematic.draw() uses, for one protein or
+for a whole dataset at once
+
+dataset_layout.from_store() works out the boxes and text of every protein in a
+domain_store in one pass over its arrays, without drawing anything. The result
+can be saved as JSON or .npz, so a client can draw the schematics itself.
+
+Coordinates are figure fractions, measured from the top left corner of the
+figure (x right, y down), so a client only needs to scale them by its canvas size.
+Boxes are listed in drawing order (by zorder, then in the order they were added),
+and text is drawn on top of the boxes.
+
+"""
+
+import json
+
+import numpy
+
+from .data import domain_label_lookup
+
+# [left, bottom, width, height] figure fractions and y limits of the two axes of a schematic
+AX_POSITION = [0, 0.5, 1.0, 0.5]
+AX_YLIM = [-1, 1]
+AXLAB_POSITION = [0, 0.0, 1.0, 0.60]
+AXLAB_YLIM = [0, 10]
+
+LABEL_Y = 9 # y of the top row of 'gen' domain labels, in the label axes
+LABEL_SPACING = 1.2 # label rows are this many text heights apart
+
+HA = ('left', 'center', 'right')
+VA = ('baseline', 'center')
+
+def layout_params(length, max_len, fixed, thumb):
+    """
+    **Purpose**
+        The padding and box sizes of a schematic
+
+    **Arguments**
+        length
+            length of the protein. Can be an array, to lay out many proteins at once.
+
+        max_len
+            length of the longest protein, sets the scale when not fixed
+
+        fixed, thumb
+            see schematic() and draw()
+
+    **Returns**
+        A dict of the parameters, pad1 and pad2 are arrays if length is
+    """
+    if thumb:
+        return {"pad1": length * 0.02,
+            "pad2": length * 0.003,
+            "figsize": (1.5, 0.3),
+            "lpad": 0.16,
+            "evpad": 0.5,
+            "nvpad": 0.4}
+    elif not fixed:
+        return {"pad1": max_len * 0.035, # pad out 1% of the figure left and right
+            "pad2": max_len * 0.003,
+            "figsize": (25, 1),
+            "lpad": 0.02, # vertical size of the central line
+            "evpad": 0.25, # vertical size of the 'normal' rectangle domain boxes.
+            "nvpad": 0.2,
+            "titlepos": "left",
+            "titlesize": 13} # vertical size of the 'enhanced' rectangle domain boxes.
+    return {"pad1":  length * 0.03, # pad out 1% of the figure left and right
+        "pad2": length * 0.003,
+        "figsize": (7, 1),
+        "lpad": 0.02, # vertical size of the central line
+        "evpad": 0.20, # vertical size of the 'normal' rectangle domain boxes.
+        "nvpad": 0.2,
+        "titlesize": 13
+        } # vertical size of the 'enhanced' rectangle domain boxes.
+
+def label_tiers(lefts, rights, height):
+    """
+    **Purpose**
+        Stack labels into rows (tiers), so they do not collide: taken from the left,
+        each label goes into the highest row that is clear of it. One pass, and no
+        randomness, so the same labels always get the same rows.
+
+    **Arguments**
+        lefts, rights
+            x extents of the labels, in the data units of the label axes
+
+        height
+            height of a label, in the data units of the label axes
+
+    **Returns**
+        A list of the y of each label in the label axes. Rows that would fall out
+        of the bottom of the axes wrap back to the top.
+    """
+    ends = [] # right-most x of the labels in each row
+    ys = [LABEL_Y] * len(lefts)
+    for i in sorted(range(len(lefts)), key=lambda i: lefts[i]):
+        row = next((r for r, right in enumerate(ends) if right < lefts[i]), len(ends))
+        if row == len(ends):
+            ends.append(0)
+        ends[row] = rights[i]
+        ys[i] = LABEL_Y - (row * height * LABEL_SPACING) % LABEL_Y # stay inside the axes
+    return ys
+
+def xlims(length, max_len, fixed, p):
+    """
+    **Purpose**
+        x limits of the domain and label axes
+
+    **Returns**
+        ([left, right], [left, right]) of the domain axes and the label axes
+    """
+    if fixed:
+        return [-p["pad1"], length+p["pad1"]], [-p["pad1"], length+p["pad1"]]
+    return [-p["pad1"], max_len+p["pad1"]], [-p["pad1"], length+p["pad1"]]
+
+class native_canvas:
+    """
+    Base of the canvases of the native backends, svg.svg_canvas and raster.raster_canvas.
+    Subclasses set width and height, in their own units, and axes_class.
+    """
+    axes_class = None
+
+    def axes(self, position, xlim, ylim):
+        """
+        **Purpose**
+            Add an axes, in the same [left, bottom, width, height] figure fractions
+            as matplotlib's Axes.set_position()
+        """
+        return self.axes_class(self, position, xlim, ylim)
+
+class native_axes:
+    """
+    Base of the axes of the native backends: the transform from data coordinates
+    to canvas units, measured from the top left corner, as the matplotlib path lays out the figure.
+    """
+    def __init__(self, canvas, position, xlim, ylim):
+        self.canvas = canvas
+        left, bottom, width, height = position
+        self.x0 = left * canvas.width
+        self.y0 = (1.0 - bottom) * canvas.height # canvas y runs down the page
+        self.w = width * canvas.width
+        self.h = height * canvas.height
+        self.xlim = xlim
+        self.ylim = ylim
+
+    def tx(self, x):
+        return self.x0 + (x - self.xlim[0]) / (self.xlim[1] - self.xlim[0]) * self.w
+
+    def ty(self, y):
+        return self.y0 - (y - self.ylim[0]) / (self.ylim[1] - self.ylim[0]) * self.h
+
+def _per(value, index):
+    # A per-protein array or a scalar, as one entry per index
+    if numpy.ndim(value):
+        return numpy.asarray(value)[index]
+    return numpy.full(len(index), value, dtype=float)
+
+class dataset_layout:
+    def __init__(self):
+        """
+        **Purpose**
+            The boxes and text of a set of schematics, as flat arrays.
+
+            The boxes of protein i are the slice box_offsets[i]:box_offsets[i+1]
+            of the box_ arrays, and likewise for text. Colours are indices into
+            colours, -1 means none. text_ha and text_va index HA and VA.
+
+            Build one with dataset_layout.from_store()
+        """
+        self.names = []
+        self.figsize = (0, 0)
+        self.colours = []
+
+        self.box_offsets = numpy.zeros(1, dtype=numpy.int64)
+        self.box_x0 = numpy.zeros(0)
+        self.box_y0 = numpy.zeros(0)
+        self.box_x1 = numpy.zeros(0)
+        self.box_y1 = numpy.zeros(0)
+        self.box_fc = numpy.zeros(0, dtype=numpy.int32)
+        self.box_ec = numpy.zeros(0, dtype=numpy.int32)
+
+        self.text_offsets = numpy.zeros(1, dtype=numpy.int64)
+        self.text_x = numpy.zeros(0)
+        self.text_y = numpy.zeros(0)
+        self.text = []
+        self.text_size = numpy.zeros(0)
+        self.text_colour = numpy.zeros(0, dtype=numpy.int32)
+        self.text_ha = numpy.zeros(0, dtype=numpy.int8)
+        self.text_va = numpy.zeros(0, dtype=numpy.int8)
+
+    @classmethod
+    def from_store(cls, store, style, col_map, fixed=True, thumb=False, max_len=None):
+        """
+        **Purpose**
+            Lay out every protein in store, as draw() would
+
+        **Arguments**
+            store
+                a domain_store
+
+            style
+                'ubl', 'ptp', 'gen' or 'episcan'
+
+            col_map
+                the colour map of the style
+
+            fixed, thumb
+                see schematic() and draw()
+
+            max_len (Optional, default=the longest protein in store)
+                the length that sets the scale when not fixed
+
+        **Returns**
+            A dataset_layout. The 'gen' domain labels are given at their anchor, the
+            top row of the label axes, and are not moved apart.
+        """
+        assert style in ('ubl', 'ptp', 'gen', 'episcan'), "{0} style not available in dataset_layout (ubl, ptp, gen, episcan)".format(style)
+        if not max_len:
+            max_len = store.max_len()
+
+        new = cls()
+        nprot = len(store)
+        new.names = [store.protein_name(i) for i in range(nprot)]
+
+        length = store.protein_len.astype(float)
+        p = layout_params(length, max_len, fixed, thumb)
+        new.figsize = p["figsize"]
+        (ax_lo, ax_hi), (lab_lo, lab_hi) = xlims(length, max_len, fixed, p)
+        lims = {False: (_per(ax_lo, numpy.arange(nprot)), _per(ax_hi, numpy.arange(nprot)), AX_POSITION, AX_YLIM),
+            True: (_per(lab_lo, numpy.arange(nprot)), _per(lab_hi, numpy.arange(nprot)), AXLAB_POSITION, AXLAB_YLIM)}
+
+        colour_ids = {}
+        def colour(c):
+            if c not in colour_ids:
+                colour_ids[c] = len(colour_ids)
+            return colour_ids[c]
+
+        def fig_x(owner, x, lab):
+            lo, hi, pos, ylim = lims[lab]
+            return pos[0] + (x - lo[owner]) / (hi[owner] - lo[owner]) * pos[2]
+
+        def fig_y(y, lab):
+            lo, hi, pos, ylim = lims[lab]
+            return 1.0 - (pos[1] + (y - ylim[0]) / (ylim[1] - ylim[0]) * pos[3])
+
+        boxes = [] # (zorder, owner, x0, y0, x1, y1, fc, ec) per group of boxes
+        texts = [] # (owner, x, y, strings, size, colour, ha, va)
+
+        def add_boxes(zorder, owner, x0, y0, x1, y1, fc, ec=-1, lab=False):
+            # (x0, y0) is the top left corner in the figure, which is (x0, y1) in the axes
+            n = len(owner)
+            boxes.append((numpy.full(n, zorder), owner, fig_x(owner, x0, lab), numpy.broadcast_to(fig_y(y1, lab), n),
+                fig_x(owner, x1, lab), numpy.broadcast_to(fig_y(y0, lab), n),
+                numpy.broadcast_to(fc, n), numpy.broadcast_to(ec, n)))
+
+        def add_text(owner, x, y, strings, size, col, ha, va, lab=False):
+            n = len(owner)
+            texts.append((owner, fig_x(owner, x, lab), numpy.broadcast_to(fig_y(y, lab), n), list(strings),
+                numpy.broadcast_to(size, n), numpy.broadcast_to(col, n), numpy.full(n, HA.index(ha)), numpy.full(n, VA.index(va))))
+
+        proteins = numpy.arange(nprot)
+        owner = numpy.repeat(proteins, store.domain_counts())
+        start = store.dom_start.astype(float)
+        end = store.dom_end.astype(float)
+        mid = (start + end) / 2
+        pad2 = _per(p["pad2"], owner)
+        names = numpy.array(store.name_vocab + [None], dtype=object)[store.dom_name]
+
+        # The line for the protein
+        add_boxes(1, proteins, numpy.zeros(nprot), -p["lpad"], length - 1, p["lpad"], colour("black"))
+
+        if style in ('ubl', 'ptp'):
+            fam = store.dom_fam == (store.fam_vocab.index("FAMILY-DEFINING") if "FAMILY-DEFINING" in store.fam_vocab else -2)
+
+            # __ubl_colour(), resolved once per type, db and name rather than per domain
+            types = [t.replace("RING finger", "RNF finger") for t in store.type_vocab]
+            by_type = numpy.array([colour(col_map[t]) if t in col_map else -1 for t in types] + [-1])
+            db_labels = [domain_label_lookup.get(db) for db in store.db_vocab]
+            by_db = numpy.array([colour(col_map[l]) if l in col_map else -1 for l in db_labels] + [-1])
+            by_name = numpy.array([colour(col_map[n]) if n in col_map else -1 for n in store.name_vocab] + [-1])
+
+            t = store.protein_type[owner]
+            db = store.dom_db
+            fc = numpy.where(by_type[t] >= 0, by_type[t], numpy.where(by_db[db] >= 0, by_db[db], by_name[store.dom_name]))
+            label = numpy.where(by_type[t] >= 0, numpy.array(types + [None], dtype=object)[t],
+                numpy.where(by_db[db] >= 0, numpy.array(db_labels + [None], dtype=object)[db],
+                numpy.where(by_name[store.dom_name] >= 0, names, numpy.array(store.db_vocab + [None], dtype=object)[db])))
+            missing = fam & (fc < 0)
+            for i in numpy.unique(db[missing]):
+                print("Warning: '%s' not found in colour map" % store.db_vocab[i])
+            fc = numpy.where(missing, colour("pink"), fc)
+
+            add_boxes(2, owner[~fam], start[~fam], -p["nvpad"], end[~fam], p["nvpad"], colour("grey"))
+            add_boxes(100000, owner[fam], start[fam], -p["evpad"], end[fam], p["evpad"], fc[fam])
+
+            if not thumb:
+                # numbers showing the aa position of the domain
+                add_text(owner[fam], start[fam]+pad2[fam], 0, (start[fam]+1).astype(numpy.int64).astype(str), 5, colour("black"), "left", "center")
+                add_text(owner[fam], end[fam]-pad2[fam], 0, (end[fam]+1).astype(numpy.int64).astype(str), 5, colour("black"), "right", "center")
+                add_text(owner, mid, -0.5, numpy.where(fam, label, names).astype(str), numpy.where(fam, 9, 6),
+                    numpy.where(fam, colour("black"), colour("grey")), "center", "center")
+
+                # the title. __ubl_colour() renames RING fingers of proteins with a FAMILY-DEFINING domain
+                # Like the rest of the style, it is only drawn for proteins with domains.
+                has_fam = numpy.bincount(owner[fam], minlength=nprot) > 0
+                titled = proteins[store.domain_counts() > 0]
+                add_text(titled, length[titled]/2, 0.7, ["%s (%s)" % (new.names[i], (types if has_fam[i] else store.type_vocab)[store.protein_type[i]]) for i in titled],
+                    p["titlesize"], colour("black"), "center", "baseline")
+        else:
+            add_boxes(1, owner, start, -0.25, end, 0.25, colour("grey"), colour("lightgrey"))
+
+            if not thumb:
+                add_text(owner, mid, LABEL_Y, names.astype(str), 6, colour("black"), "center", "center", lab=True)
+                # numbers showing the aa position of the domain
+                add_text(owner, start+pad2, 0.4, (start+1).astype(numpy.int64).astype(str), 5, colour("black"), "center", "center")
+                add_text(owner, end-pad2, 0.4, (end+1).astype(numpy.int64).astype(str), 5, colour("black"), "center", "center")
+
+        if not thumb: # numbers showing the aa position of peptide
+            tpad = _per(p["pad1"], proteins) / 10
+            add_text(proteins, -tpad, 0, ["0"] * nprot, 5, colour("black"), "right", "center")
+            add_text(proteins, length+tpad, 0, store.protein_len.astype(str), 5, colour("black"), "left", "center")
+
+        # Group by protein, in drawing order
+        zorder, box_owner, x0, y0, x1, y1, fc, ec = [numpy.concatenate(c) for c in zip(*boxes)]
+        order = numpy.lexsort((zorder, box_owner))
+        new.box_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(box_owner, minlength=nprot)))).astype(numpy.int64)
+        new.box_x0, new.box_y0, new.box_x1, new.box_y1 = x0[order], y0[order], x1[order], y1[order]
+        new.box_fc = fc[order].astype(numpy.int32)
+        new.box_ec = ec[order].astype(numpy.int32)
+
+        if texts:
+            text_owner, x, y, strings, size, col, ha, va = zip(*texts)
+            text_owner = numpy.concatenate(text_owner)
+            order = numpy.argsort(text_owner, kind='stable')
+            new.text_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(text_owner, minlength=nprot)))).astype(numpy.int64)
+            new.text_x = numpy.concatenate(x)[order]
+            new.text_y = numpy.concatenate(y)[order]
+            strings = sum(strings, [])
+            new.text = [strings[i] for i in order]
+            new.text_size = numpy.concatenate(size)[order].astype(float)
+            new.text_colour = numpy.concatenate(col)[order].astype(numpy.int32)
+            new.text_ha = numpy.concatenate(ha)[order].astype(numpy.int8)
+            new.text_va = numpy.concatenate(va)[order].astype(numpy.int8)
+        else:
+            new.text_offsets = numpy.zeros(nprot + 1, dtype=numpy.int64)
+
+        new.colours = list(colour_ids)
+        return new
+
+    def __len__(self):
+        return len(self.names)
+
+    def protein(self, index):
+        """
+        **Purpose**
+            The layout of protein <index>
+
+        **Returns**
+            {"name", "boxes": [[x0, y0, x1, y1, fc, ec], ...], "texts": [[x, y, text, size, colour, ha, va], ...]}
+            with colours as names ("none" for no colour), and ha, va as strings
+        """
+        def col(i):
+            return self.colours[i] if i >= 0 else "none"
+
+        b = range(self.box_offsets[index], self.box_offsets[index+1])
+        t = range(self.text_offsets[index], self.text_offsets[index+1])
+        return {"name": self.names[index],
+            "boxes": [[self.box_x0[i], self.box_y0[i], self.box_x1[i], self.box_y1[i], col(self.box_fc[i]), col(self.box_ec[i])] for i in b],
+            "texts": [[self.text_x[i], self.text_y[i], self.text[i], self.text_size[i], col(self.text_colour[i]), HA[self.text_ha[i]], VA[self.text_va[i]]] for i in t]}
+
+    def to_dict(self, decimals=5):
+        """
+        **Purpose**
+            The layout as a dict of plain lists, ready for json.dump()
+        """
+        def r(a):
+            return numpy.round(a, decimals).tolist()
+
+        return {"figsize": list(self.figsize), "colours": self.colours, "ha": HA, "va": VA, "names": self.names,
+            "boxes": {"offsets": self.box_offsets.tolist(), "x0": r(self.box_x0), "y0": r(self.box_y0),
+                "x1": r(self.box_x1), "y1": r(self.box_y1), "fc": self.box_fc.tolist(), "ec": self.box_ec.tolist()},
+            "texts": {"offsets": self.text_offsets.tolist(), "x": r(self.text_x), "y": r(self.text_y), "text": self.text,
+                "size": self.text_size.tolist(), "colour": self.text_colour.tolist(), "ha": self.text_ha.tolist(), "va": self.text_va.tolist()}}
+
+    def save_json(self, filename, decimals=5):
+        """
+        **Purpose**
+            Save the layout as JSON, see to_dict()
+        """
+        with open(filename, 'wt') as oh:
+            json.dump(self.to_dict(decimals), oh, separators=(',', ':'))
+
+    def save_npz(self, filename):
+        """
+        **Purpose**
+            Save the layout as a compressed numpy .npz file
+        """
+        numpy.savez_compressed(filename, figsize=numpy.array(self.figsize), colours=numpy.array(self.colours, dtype=str),
+            names=numpy.array(self.names, dtype=str), text=numpy.array(self.text, dtype=str),
+            **{k: getattr(self, k) for k in ('box_offsets', 'box_x0', 'box_y0', 'box_x1', 'box_y1', 'box_fc', 'box_ec',
+                'text_offsets', 'text_x', 'text_y', 'text_size', 'text_colour', 'text_ha', 'text_va')})
@@ -0,0 +1,82 @@
+"""
+
+Incremental rendering: remember what each output image was drawn from
+
+A manifest, <output path>/.ddmanifest.json, maps each image filename to a
+hash of everything that decides what the image looks like: the record, the style,
+the colour map, the layout settings and the version of the drawing code.
+schematic.draw_all(incremental=True) skips any image that still exists and whose
+hash has not changed.
+
+"""
+
+import os, json, hashlib
+
+# Bump when a change to the drawing code changes the images, so every image is redrawn
+RENDER_VERSION = 1
+
+MANIFEST_NAME = '.ddmanifest.json'
+
+def render_key(item, style, col_map, settings):
+    """
+    **Purpose**
+        Stable hash of everything an image is drawn from
+
+    **Arguments**
+        item
+            the record, a {"name", "type", "domains", "len"} dict
+
+        style
+            the draw() style
+
+        col_map
+            the colour map in use
+
+        settings
+            dict of any other layout settings, e.g. thumb, backend, fixed and max_len
+
+    **Returns**
+        The hash as a hex string
+    """
+    import matplotlib
+    key = {'version': [RENDER_VERSION, matplotlib.__version__],
+        'item': [item["name"], item["type"], item["len"],
+            [[d["name"], list(d["pos"]), d["db"], d.get("fam")] for d in item["domains"]]],
+        'style': style,
+        'col_map': col_map,
+        'settings': settings}
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(key, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+class render_manifest:
+    def __init__(self, path):
+        """
+        **Purpose**
+            Load the manifest in directory path, or start an empty one
+        """
+        self.filename = os.path.join(path, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'rt') as fh:
+                    self.entries = json.load(fh)
+            except ValueError:
+                print("Warning: '%s' is corrupt, redrawing everything" % self.filename)
+
+    def is_current(self, filename, key):
+        """
+        **Purpose**
+            True if filename exists, and was drawn from key
+        """
+        return self.entries.get(os.path.basename(filename)) == key and os.path.exists(filename)
+
+    def update(self, filename, key):
+        self.entries[os.path.basename(filename)] = key
+
+    def save(self):
+        # Write and rename, so an interrupted run never leaves a half written manifest
+        tmp = '{0}.tmp'.format(self.filename)
+        with open(tmp, 'wt') as oh:
+            json.dump(self.entries, oh, sort_keys=True)
+        os.replace(tmp, self.filename)
@@ -0,0 +1,103 @@
+"""
+
+A NumPy raster writer for the 'raster' backend of schematic.draw()
+
+Thumbnails are only coloured rectangles, so they are painted straight into
+an RGBA array with slice assignment, and saved as a PNG with zlib.
+Coordinates follow the same figure/axes layout as the matplotlib path.
+
+"""
+
+import struct, zlib
+
+import numpy
+
+from .layout import native_canvas, native_axes
+
+_colour_cache = {}
+
+def rgba_bytes(colour):
+    """
+    **Purpose**
+        Any matplotlib colour (name, hex, tuple) as a uint8 RGBA array
+    """
+    key = colour if isinstance(colour, str) else tuple(colour)
+    if key not in _colour_cache:
+        from matplotlib.colors import to_rgba
+        _colour_cache[key] = numpy.array([round(c * 255) for c in to_rgba(colour)], dtype=numpy.uint8)
+    return _colour_cache[key]
+
+def png_encode(pixels, compression=6):
+    """
+    **Purpose**
+        Encode a (height, width, 4) uint8 RGBA array as PNG
+
+    **Returns**
+        The PNG file as bytes
+    """
+    height, width = pixels.shape[:2]
+    # Every scanline is prefixed by its filter type, 0 (None)
+    raw = numpy.zeros((height, width * 4 + 1), dtype=numpy.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw.tobytes(), compression))
+        + chunk(b'IEND', b''))
+
+class raster_axes(native_axes):
+    def text_width(self, s, fontsize):
+        return 0
+
+    def text_height(self, fontsize):
+        return 0
+
+    def rect(self, x, y, width, height, fc, ec="none", lw=0, zorder=1):
+        """
+        **Purpose**
+            As ax.add_patch(Rectangle((x, y), width, height, ...)).
+            Edges are thinner than a pixel at thumbnail sizes, and are not drawn.
+        """
+        x1, x2 = sorted((self.tx(x), self.tx(x + width)))
+        y1, y2 = sorted((self.ty(y + height), self.ty(y)))
+        # Snap to whole pixels, but never let a box vanish
+        x1, y1 = int(round(x1)), int(round(y1))
+        x2, y2 = max(int(round(x2)), x1 + 1), max(int(round(y2)), y1 + 1)
+        c = self.canvas
+        self.canvas.rects.append((zorder, len(c.rects), max(x1, 0), max(y1, 0), min(x2, c.width), min(y2, c.height), rgba_bytes(fc)))
+
+    def text(self, x, y, s, fontsize, color="black", ha="left", va="baseline", zorder=3):
+        pass # Thumbnails have no text
+
+class raster_canvas(native_canvas):
+    axes_class = raster_axes
+
+    def __init__(self, figsize, dpi=100):
+        """
+        **Purpose**
+            A white RGBA image of figsize inches at dpi (matplotlib's default figure dpi is 100)
+        """
+        self.dpi = dpi
+        self.width = int(round(figsize[0] * dpi))
+        self.height = int(round(figsize[1] * dpi))
+        self.rects = [] # (zorder, n, x1, y1, x2, y2, colour), painted in zorder at save
+
+    def render(self):
+        """
+        **Purpose**
+            Paint the rectangles
+
+        **Returns**
+            A (height, width, 4) uint8 array
+        """
+        pixels = numpy.full((self.height, self.width, 4), 255, dtype=numpy.uint8)
+        for zorder, n, x1, y1, x2, y2, colour in sorted(self.rects, key=lambda r: r[:2]):
+            pixels[y1:y2, x1:x2] = colour
+        return pixels
+
+    def save(self, filename):
+        with open(filename, 'wb') as oh:
+            oh.write(png_encode(self.render()))
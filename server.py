@@ -0,0 +1,201 @@
+"""
+
+A long running render server, so that many small batches do not each pay for
+starting Python, importing matplotlib and loading the fonts.
+
+    python -m domain_draw.draw_domains serve --socket domain_draw.sock -w 4
+
+The server listens on a Unix domain socket, and hands the drawing to a pool of
+processes that are set up (Agg backend, fonts, figures) once, at start up.
+Each connection is served on its own thread, so requests run concurrently.
+
+Requests and replies are one JSON object per line:
+
+    {"op": "render", "items": [<record>, ...], "style": "ubl", "thumb": false,
+        "backend": "matplotlib", "path": <output directory>}
+        -> {"ok": true, "filenames": [...]}
+
+        Records are {"name", "type", "len", "domains": [{"name", "pos", "db", "fam"}, ...]}
+        dicts, as made by schematic.iter_records(). Instead of "path", "filenames"
+        can give the filename of each item. Optional: "fixed" (default true),
+        "max_len" (default the longest item in the request), "pdf" and "svg" (default false),
+        "label_layout" (default "adjust", see schematic()).
+
+    {"op": "stats"} -> {"ok": true, "stats": {...}}
+    {"op": "shutdown"} -> {"ok": true}
+
+Errors are returned as {"ok": false, "error": <message>}.
+
+"""
+
+import os, json, time, socket, socketserver, threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+from .draw_domains import schematic, style_col_maps
+
+_serve_worker = None
+
+def _init_serve_worker():
+    # process pool initializer: a headless schematic, with its fonts and figures ready
+    global _serve_worker
+    matplotlib.use('Agg', force=True)
+    _serve_worker = schematic(pdf=False)
+
+    item = {"name": "warm up", "type": "", "len": 100,
+        "domains": [{"name": "domain", "pos": (10, 40), "db": "", "fam": None}]}
+    for thumb in (False, True):
+        _serve_worker.draw_pixels(item, "gen", thumb, backend='matplotlib')
+
+def _serve_render(request):
+    # process pool worker: draw the items of one render request
+    s = _serve_worker
+    items = request["items"]
+    style = request.get("style", "ubl")
+    thumb = request.get("thumb", False)
+    backend = request.get("backend", "matplotlib")
+
+    if style in style_col_maps:
+        s.col_map = style_col_maps[style]
+    s.fixed = request.get("fixed", True)
+    s.pdf = request.get("pdf", False)
+    s.svg = request.get("svg", False)
+    s.label_layout = request.get("label_layout", "adjust")
+    assert s.label_layout in ('adjust', 'tiers'), "label_layout '{0}' not one of 'adjust', 'tiers'".format(s.label_layout)
+    s.max_len = request.get("max_len") or max(item["len"] for item in items)
+
+    filenames = request.get("filenames") or [s.output_filename(item, backend, request.get("path", "."), thumb) for item in items]
+    assert len(filenames) == len(items), 'render request has {0} items but {1} filenames'.format(len(items), len(filenames))
+    for item, filename in zip(items, filenames):
+        s.draw(item, filename, style, thumb, backend)
+    return filenames
+
+class render_stats:
+    def __init__(self, window=1000):
+        """
+        **Purpose**
+            Request counters, and the latency of the last <window> render requests
+        """
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.images = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency = deque(maxlen=window)
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, seconds, images, ok=True):
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.images += images
+            self.errors += not ok
+            self.latency.append(seconds)
+
+    def report(self):
+        """
+        **Returns**
+            A dict of the counters. Latencies are in milliseconds, throughput is images per second
+        """
+        with self.lock:
+            latency = sorted(self.latency)
+            uptime = time.time() - self.started
+            out = {"uptime": round(uptime, 1), "requests": self.requests, "images": self.images,
+                "errors": self.errors, "in_flight": self.in_flight,
+                "images_per_second": round(self.images / uptime, 2) if uptime else 0.0}
+
+        if latency:
+            def pc(q):
+                return round(latency[min(int(q * len(latency)), len(latency) - 1)] * 1000, 2)
+            out["latency_ms"] = {"mean": round(sum(latency) / len(latency) * 1000, 2),
+                "p50": pc(0.5), "p95": pc(0.95), "max": round(latency[-1] * 1000, 2)}
+        return out
+
+class _render_handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                reply = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                reply = {"ok": False, "error": "{0}: {1}".format(type(e).__name__, e)}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class render_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=None):
+        """
+        **Purpose**
+            A render server on socket_path, drawing with a pool of <workers> processes.
+            Call serve_forever() to start it.
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # left over from a server that did not shut down cleanly
+        self.socket_path = socket_path
+        self.stats = render_stats()
+        workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_serve_worker)
+        # Start and warm up the workers now, not on the first requests
+        for f in [self.pool.submit(int) for i in range(workers)]:
+            f.result()
+        socketserver.UnixStreamServer.__init__(self, socket_path, _render_handler)
+
+    def dispatch(self, request):
+        op = request.get("op")
+        if op == "render":
+            self.stats.begin()
+            start = time.time()
+            ok = False
+            try:
+                filenames = self.pool.submit(_serve_render, request).result()
+                ok = True
+            finally:
+                self.stats.end(time.time() - start, len(filenames) if ok else 0, ok)
+            return {"ok": True, "filenames": filenames}
+        elif op == "stats":
+            return {"ok": True, "stats": self.stats.report()}
+        elif op == "shutdown":
+            threading.Thread(target=self.shutdown).start() # shutdown() waits for serve_forever() to return
+            return {"ok": True}
+        raise ValueError("unknown op '{0}'".format(op))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.shutdown(wait=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def serve(socket_path, workers=None):
+    """
+    **Purpose**
+        Run a render server on socket_path until it is sent {"op": "shutdown"}
+    """
+    server = render_server(socket_path, workers)
+    print("Serving on {0}".format(socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def request(socket_path, message):
+    """
+    **Purpose**
+        Send one request to a render server and wait for the reply
+
+    **Returns**
+        The reply, as a dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as fh:
+            return json.loads(fh.readline())
@@ -0,0 +1,208 @@
+"""
+
+Output sinks: where drawn images are written
+
+A sink takes (name, data) pairs, where name is a relative filename such as
+'thumbs/PROT1.png' and data is the encoded image. The image files can go to:
+
+    directory_sink  plain files under a directory
+    tar_sink        an uncompressed tar file
+    zip_sink        a zip file (PNG and PDF are stored as is, SVG is deflated)
+    bundle_sink     a single file key-value bundle, read back with bundle_reader
+
+async_sink wraps any of them, and does the writing on background threads, so
+drawing carries on while the filesystem is busy. open_sink() picks the sink from
+the target name.
+
+Bundle layout:
+    8 bytes     magic, b'DDBUNDLE'
+    uint32      format version
+    data        the images, back to back
+    JSON index  {name: [offset, size], ...}
+    uint64      offset of the JSON index
+    uint64      length of the JSON index
+    8 bytes     magic, b'DDBUNDLE'
+
+"""
+
+import os, io, json, time, struct, tarfile, zipfile, threading
+from concurrent.futures import ThreadPoolExecutor
+
+BUNDLE_MAGIC = b'DDBUNDLE'
+BUNDLE_VERSION = 1
+
+class directory_sink:
+    concurrent = True # independent files, so several can be written at once
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, name, data):
+        filename = os.path.join(self.path, name)
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        with open(filename, 'wb') as oh:
+            oh.write(data)
+
+    def close(self):
+        pass
+
+class tar_sink:
+    concurrent = False
+
+    def __init__(self, filename):
+        self.tar = tarfile.open(filename, 'w')
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+
+class zip_sink:
+    concurrent = False
+
+    def __init__(self, filename):
+        self.zip = zipfile.ZipFile(filename, 'w', allowZip64=True)
+
+    def write(self, name, data):
+        # PNG and PDF are already compressed
+        compression = zipfile.ZIP_DEFLATED if name.endswith('.svg') else zipfile.ZIP_STORED
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compression
+        self.zip.writestr(info, data)
+
+    def close(self):
+        self.zip.close()
+
+class bundle_sink:
+    concurrent = False
+
+    def __init__(self, filename):
+        self.oh = open(filename, 'wb')
+        self.oh.write(BUNDLE_MAGIC + struct.pack('<I', BUNDLE_VERSION))
+        self.index = {}
+
+    def write(self, name, data):
+        if name in self.index:
+            print("Warning: '%s' is already in the bundle, replacing it" % name)
+        self.index[name] = [self.oh.tell(), len(data)]
+        self.oh.write(data)
+
+    def close(self):
+        if self.oh.closed:
+            return
+        index = json.dumps(self.index).encode('utf-8')
+        offset = self.oh.tell()
+        self.oh.write(index)
+        self.oh.write(struct.pack('<QQ', offset, len(index)) + BUNDLE_MAGIC)
+        self.oh.close()
+
+class bundle_reader:
+    def __init__(self, filename):
+        """
+        **Purpose**
+            Read the images back out of a bundle made by bundle_sink
+
+            reader[name] returns the bytes of an image, names() lists them
+        """
+        self.fh = open(filename, 'rb')
+        head = self.fh.read(len(BUNDLE_MAGIC) + 4)
+        assert head[:len(BUNDLE_MAGIC)] == BUNDLE_MAGIC, '{0} is not a bundle'.format(filename)
+        version = struct.unpack('<I', head[len(BUNDLE_MAGIC):])[0]
+        assert version == BUNDLE_VERSION, '{0} is bundle version {1}, expected {2}'.format(filename, version, BUNDLE_VERSION)
+
+        self.fh.seek(-(16 + len(BUNDLE_MAGIC)), os.SEEK_END)
+        tail = self.fh.read()
+        assert tail[16:] == BUNDLE_MAGIC, '{0} is truncated'.format(filename)
+        offset, length = struct.unpack('<QQ', tail[:16])
+        self.fh.seek(offset)
+        self.index = json.loads(self.fh.read(length))
+
+    def names(self):
+        return list(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        offset, size = self.index[name]
+        self.fh.seek(offset)
+        return self.fh.read(size)
+
+    def close(self):
+        self.fh.close()
+
+class async_sink:
+    def __init__(self, sink, threads=4, max_pending=64):
+        """
+        **Purpose**
+            Write to sink on background threads
+
+        **Arguments**
+            sink
+                a directory_sink, tar_sink, zip_sink or bundle_sink
+
+            threads (Optional, default=4)
+                number of writer threads. Archives are always written by one thread, in order.
+
+            max_pending (Optional, default=64)
+                number of images that can wait to be written before write() blocks,
+                this bounds the memory used
+        """
+        self.sink = sink
+        self.pool = ThreadPoolExecutor(max_workers=threads if sink.concurrent else 1)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def __done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def write(self, name, data):
+        if self.errors: # Stop early, rather than drawing everything and failing at close()
+            raise self.errors[0]
+        self.slots.acquire()
+        self.pool.submit(self.sink.write, name, data).add_done_callback(self.__done)
+
+    def close(self):
+        """
+        **Purpose**
+            Wait for the writes to finish, and close the sink. Raises the first write error, if any.
+        """
+        self.pool.shutdown(wait=True)
+        self.sink.close()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_sink(target, threads=4):
+    """
+    **Purpose**
+        Open an async_sink on target: a .tar, .zip or .ddb (bundle) file, or otherwise a directory
+
+    **Returns**
+        An async_sink
+    """
+    if target.endswith('.tar'):
+        sink = tar_sink(target)
+    elif target.endswith('.zip'):
+        sink = zip_sink(target)
+    elif target.endswith('.ddb'):
+        sink = bundle_sink(target)
+    else:
+        sink = directory_sink(target)
+    return async_sink(sink, threads)
@@ -0,0 +1,448 @@
+"""
+
+Compact columnar storage for parsed domain data
+
+"""
+
+import gc, itertools
+from array import array
+
+import numpy
+
+class domain_store:
+    # The arrays that make up a store, in the order they are serialised by cache.py
+    array_names = ('protein_offsets', 'protein_len', 'protein_type', 'name_offsets', 'name_blob',
+        'dom_start', 'dom_end', 'dom_name', 'dom_db', 'dom_fam')
+    vocab_names = ('type_vocab', 'name_vocab', 'db_vocab', 'fam_vocab')
+
+    def __init__(self):
+        """
+        **Purpose**
+            Hold a parsed domain dataset in contiguous arrays rather than as
+            a list of nested dicts.
+
+            Proteins are rows 0..n-1. The domains of protein i are the slice
+            protein_offsets[i]:protein_offsets[i+1] of the domain arrays.
+            Strings (domain names, dbs, families and protein types) are interned
+            into vocabularies and stored as integer ids, -1 means missing.
+
+            Build one with domain_store.from_records().
+        """
+        self.protein_offsets = numpy.zeros(1, dtype=numpy.int64)
+        self.protein_len = numpy.zeros(0, dtype=numpy.int64)
+        self.protein_type = numpy.zeros(0, dtype=numpy.int32)
+        self.name_offsets = numpy.zeros(1, dtype=numpy.int64)
+        self.name_blob = numpy.zeros(0, dtype=numpy.uint8)
+
+        self.dom_start = numpy.zeros(0, dtype=numpy.int64)
+        self.dom_end = numpy.zeros(0, dtype=numpy.int64)
+        self.dom_name = numpy.zeros(0, dtype=numpy.int32)
+        self.dom_db = numpy.zeros(0, dtype=numpy.int32)
+        self.dom_fam = numpy.zeros(0, dtype=numpy.int32)
+
+        self.type_vocab = []
+        self.name_vocab = []
+        self.db_vocab = []
+        self.fam_vocab = []
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        **Purpose**
+            Build a store from an iterable of protein dicts, as yielded by
+            schematic.iter_records(). The records are consumed one at a time,
+            so a generator never needs to be held in memory in full.
+
+        **Arguments**
+            records
+                iterable of {"name", "type", "domains", "len"} dicts
+
+        **Returns**
+            A domain_store
+        """
+        protein_offsets = array('q', [0])
+        protein_len = array('q')
+        protein_type = array('i')
+        name_offsets = array('q', [0])
+        name_blob = bytearray()
+
+        dom_start = array('q')
+        dom_end = array('q')
+        dom_name = array('i')
+        dom_db = array('i')
+        dom_fam = array('i')
+
+        type_ids = {}
+        name_ids = {}
+        db_ids = {}
+        fam_ids = {}
+
+        def intern(table, key):
+            if key is None:
+                return -1
+            if key not in table:
+                table[key] = len(table)
+            return table[key]
+
+        for item in records:
+            protein_len.append(item["len"])
+            protein_type.append(intern(type_ids, item["type"]))
+            name_blob += item["name"].encode("utf-8")
+            name_offsets.append(len(name_blob))
+
+            for d in item["domains"]:
+                dom_start.append(d["pos"][0])
+                dom_end.append(d["pos"][1])
+                dom_name.append(intern(name_ids, d["name"]))
+                dom_db.append(intern(db_ids, d["db"]))
+                dom_fam.append(intern(fam_ids, d.get("fam")))
+            protein_offsets.append(len(dom_start))
+
+        store = cls()
+        store.protein_offsets = numpy.frombuffer(protein_offsets, dtype=numpy.int64)
+        store.protein_len = numpy.frombuffer(protein_len, dtype=numpy.int64)
+        store.protein_type = numpy.frombuffer(protein_type, dtype=numpy.int32)
+        store.name_offsets = numpy.frombuffer(name_offsets, dtype=numpy.int64)
+        store.name_blob = numpy.frombuffer(bytes(name_blob), dtype=numpy.uint8)
+
+        store.dom_start = numpy.frombuffer(dom_start, dtype=numpy.int64)
+        store.dom_end = numpy.frombuffer(dom_end, dtype=numpy.int64)
+        store.dom_name = numpy.frombuffer(dom_name, dtype=numpy.int32)
+        store.dom_db = numpy.frombuffer(dom_db, dtype=numpy.int32)
+        store.dom_fam = numpy.frombuffer(dom_fam, dtype=numpy.int32)
+
+        store.type_vocab = list(type_ids)
+        store.name_vocab = list(name_ids)
+        store.db_vocab = list(db_ids)
+        store.fam_vocab = list(fam_ids)
+        return store
+
+    @classmethod
+    def from_columns(cls, protein, protein_len, start, end, name, db, fam=None, protein_type=""):
+        """
+        **Purpose**
+            Build a store from flat, per-domain columns, such as a tabular file
+            with one row per domain. Rows are grouped into proteins in order of
+            first appearance, and need not be sorted.
+
+        **Arguments**
+            protein, name, db, fam
+                sequences of strings, one per domain. fam may be None.
+
+            protein_len, start, end
+                integer arrays, one entry per domain. The zero-ordered positions
+                are used as given.
+
+            protein_type (Optional, default="")
+                type given to every protein
+
+        **Returns**
+            A domain_store
+        """
+        return cls.from_interned_columns(_intern_column(protein), protein_len, start, end,
+            _intern_column(name), _intern_column(db), None if fam is None else _intern_column(fam), protein_type)
+
+    @classmethod
+    def from_interned_columns(cls, protein, protein_len, start, end, name, db, fam=None, protein_type=""):
+        """
+        **Purpose**
+            As from_columns(), but each string column is already interned, as an
+            (<ids array>, <vocab>) pair, so no per-domain strings are needed
+
+        **Arguments**
+            protein, name, db, fam
+                (<ids>, <vocab>) pairs, one id per domain. fam may be None.
+
+            protein_len, start, end, protein_type
+                see from_columns()
+
+        **Returns**
+            A domain_store
+        """
+        protein_ids, protein_vocab = protein
+        protein_ids = numpy.asarray(protein_ids)
+        order = numpy.argsort(protein_ids, kind='stable')
+        first = numpy.unique(protein_ids, return_index=True)[1]
+
+        store = cls()
+        store.protein_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(protein_ids, minlength=len(protein_vocab))))).astype(numpy.int64)
+        store.protein_len = numpy.asarray(protein_len, dtype=numpy.int64)[first]
+        store.protein_type = numpy.zeros(len(protein_vocab), dtype=numpy.int32)
+        store.type_vocab = [protein_type]
+
+        names = [p.encode("utf-8") for p in protein_vocab]
+        store.name_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.fromiter(map(len, names), dtype=numpy.int64, count=len(names))))).astype(numpy.int64)
+        store.name_blob = numpy.frombuffer(b"".join(names), dtype=numpy.uint8)
+
+        store.dom_start = numpy.asarray(start, dtype=numpy.int64)[order]
+        store.dom_end = numpy.asarray(end, dtype=numpy.int64)[order]
+        store.dom_name = numpy.asarray(name[0], dtype=numpy.int32)[order]
+        store.name_vocab = list(name[1])
+        store.dom_db = numpy.asarray(db[0], dtype=numpy.int32)[order]
+        store.db_vocab = list(db[1])
+        if fam is None:
+            store.dom_fam = numpy.full(len(order), -1, dtype=numpy.int32)
+        else:
+            store.dom_fam = numpy.asarray(fam[0], dtype=numpy.int32)[order]
+            store.fam_vocab = list(fam[1])
+        return store
+
+    @classmethod
+    def concatenate(cls, stores):
+        """
+        **Purpose**
+            Join stores end to end, e.g. the per-chunk stores of a parallel parse.
+            The vocabularies are merged, in order of first appearance, and each
+            store's ids are remapped a whole array at a time.
+
+        **Arguments**
+            stores
+                iterable of domain_store
+
+        **Returns**
+            A domain_store
+        """
+        stores = list(stores)
+        new = cls()
+        if not stores:
+            return new
+
+        def counts(offsets):
+            return numpy.concatenate([numpy.diff(getattr(s, offsets)) for s in stores])
+
+        new.protein_offsets = numpy.concatenate(([0], numpy.cumsum(counts('protein_offsets')))).astype(numpy.int64)
+        new.name_offsets = numpy.concatenate(([0], numpy.cumsum(counts('name_offsets')))).astype(numpy.int64)
+        for name in ('protein_len', 'name_blob', 'dom_start', 'dom_end'):
+            setattr(new, name, numpy.concatenate([getattr(s, name) for s in stores]))
+
+        for ids_name, vocab_name in (('protein_type', 'type_vocab'), ('dom_name', 'name_vocab'),
+            ('dom_db', 'db_vocab'), ('dom_fam', 'fam_vocab')):
+            table = {}
+            ids = []
+            for s in stores:
+                vocab = getattr(s, vocab_name)
+                table.update(zip([v for v in vocab if v not in table], itertools.count(len(table))))
+                remap = numpy.array([table[v] for v in vocab] + [-1], dtype=numpy.int32) # -1, missing, maps to itself
+                ids.append(remap[getattr(s, ids_name)])
+            setattr(new, ids_name, numpy.concatenate(ids))
+            setattr(new, vocab_name, list(table))
+        return new
+
+    def to_records(self):
+        """
+        **Purpose**
+            Unpack the whole store into a list of protein dicts, as yielded by
+            schematic.iter_records(). Much faster than as_dict() on each record_view.
+
+        **Returns**
+            A list of {"name", "type", "domains", "len"} dicts
+        """
+        gc.disable() # Only new, acyclic, dicts are made here, collections just slow it down.
+        try:
+            return self.__to_records()
+        finally:
+            gc.enable()
+
+    def __to_records(self):
+        name_vocab, db_vocab = self.name_vocab, self.db_vocab
+        domains = [{"name": name_vocab[n], "pos": (st, en), "db": db_vocab[d]} for n, st, en, d in
+            zip(self.dom_name.tolist(), self.dom_start.tolist(), self.dom_end.tolist(), self.dom_db.tolist())]
+        has_fam = numpy.flatnonzero(self.dom_fam >= 0)
+        for j, f in zip(has_fam.tolist(), self.dom_fam[has_fam].tolist()):
+            domains[j]["fam"] = self.fam_vocab[f]
+
+        blob = self.name_blob.tobytes()
+        type_vocab = self.type_vocab + [None] # -1, missing, is the last entry
+        offsets = self.protein_offsets.tolist()
+        name_offsets = self.name_offsets.tolist()
+        return [{"name": blob[name_offsets[i]:name_offsets[i+1]].decode("utf-8"), "type": type_vocab[t],
+            "domains": domains[offsets[i]:offsets[i+1]], "len": l}
+            for i, (t, l) in enumerate(zip(self.protein_type.tolist(), self.protein_len.tolist()))]
+
+    def __len__(self):
+        return len(self.protein_len)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('domain_store index out of range')
+        return record_view(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield record_view(self, i)
+
+    def protein_name(self, index):
+        """
+        **Purpose**
+            Return the name of protein <index>
+        """
+        return bytes(self.name_blob[self.name_offsets[index]:self.name_offsets[index+1]]).decode("utf-8")
+
+    def domain_counts(self):
+        """
+        **Purpose**
+            Number of domains in each protein, as an array
+        """
+        return numpy.diff(self.protein_offsets)
+
+    def max_len(self):
+        """
+        **Purpose**
+            Length of the longest protein, 0 if the store is empty
+        """
+        if len(self.protein_len) == 0:
+            return 0
+        return int(self.protein_len.max())
+
+    def db_counts(self):
+        """
+        **Purpose**
+            Count the domains belonging to each db
+
+        **Returns**
+            A dictionary of {<db>: <count>}
+        """
+        counts = numpy.bincount(self.dom_db[self.dom_db >= 0], minlength=len(self.db_vocab))
+        return {db: int(counts[i]) for i, db in enumerate(self.db_vocab)}
+
+    def proteins_with(self, db=None, name=None, fam=None):
+        """
+        **Purpose**
+            Find the proteins that carry at least one domain matching all of
+            the given db, name and fam
+
+        **Returns**
+            A boolean array, one entry per protein, suitable for filter()
+        """
+        dom_mask = numpy.ones(len(self.dom_start), dtype=bool)
+        for value, vocab, ids in ((db, self.db_vocab, self.dom_db),
+            (name, self.name_vocab, self.dom_name),
+            (fam, self.fam_vocab, self.dom_fam)):
+            if value is None:
+                continue
+            if value not in vocab:
+                return numpy.zeros(len(self), dtype=bool)
+            dom_mask &= ids == vocab.index(value)
+
+        owner = numpy.repeat(numpy.arange(len(self)), self.domain_counts())
+        return numpy.bincount(owner[dom_mask], minlength=len(self)) > 0
+
+    def filter(self, mask):
+        """
+        **Purpose**
+            Return a new domain_store holding only the proteins selected by mask
+
+        **Arguments**
+            mask
+                boolean array, one entry per protein. Or an array of protein indices.
+
+        **Returns**
+            A domain_store. The vocabularies are shared with this store.
+        """
+        keep = numpy.asarray(mask)
+        if keep.dtype == bool:
+            keep = numpy.nonzero(keep)[0]
+
+        counts = self.domain_counts()[keep]
+        dom_index = numpy.repeat(self.protein_offsets[keep] - numpy.cumsum(numpy.concatenate(([0], counts[:-1]))), counts) + numpy.arange(counts.sum())
+
+        name_lens = numpy.diff(self.name_offsets)[keep]
+        name_index = numpy.repeat(self.name_offsets[keep] - numpy.cumsum(numpy.concatenate(([0], name_lens[:-1]))), name_lens) + numpy.arange(name_lens.sum())
+
+        new = domain_store()
+        new.protein_offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.int64)
+        new.protein_len = self.protein_len[keep]
+        new.protein_type = self.protein_type[keep]
+        new.name_offsets = numpy.concatenate(([0], numpy.cumsum(name_lens))).astype(numpy.int64)
+        new.name_blob = self.name_blob[name_index]
+
+        new.dom_start = self.dom_start[dom_index]
+        new.dom_end = self.dom_end[dom_index]
+        new.dom_name = self.dom_name[dom_index]
+        new.dom_db = self.dom_db[dom_index]
+        new.dom_fam = self.dom_fam[dom_index]
+
+        new.type_vocab = self.type_vocab
+        new.name_vocab = self.name_vocab
+        new.db_vocab = self.db_vocab
+        new.fam_vocab = self.fam_vocab
+        return new
+
+def _intern_column(values):
+    # Map strings to integer ids, numbered in order of first appearance
+    vocab = list(dict.fromkeys(values))
+    table = {v: i for i, v in enumerate(vocab)}
+    return numpy.fromiter(map(table.__getitem__, values), dtype=numpy.int32, count=len(values)), vocab
+
+class record_view:
+    """
+    A lightweight, read-mostly view of a single protein in a domain_store.
+
+    Behaves like the {"name", "type", "domains", "len"} dicts produced by
+    schematic.iter_records(), so it can be passed straight to schematic.draw().
+    The domain dicts are only built when "domains" is asked for. Assigning
+    a key stores a local override and leaves the store untouched.
+    """
+    __slots__ = ('store', 'index', 'overrides')
+
+    keys_ = ("name", "type", "domains", "len")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.overrides = {}
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+
+        s = self.store
+        i = self.index
+        if key == "name":
+            return s.protein_name(i)
+        elif key == "type":
+            t = s.protein_type[i]
+            return s.type_vocab[t] if t >= 0 else None
+        elif key == "len":
+            return int(s.protein_len[i])
+        elif key == "domains":
+            domains = []
+            for j in range(s.protein_offsets[i], s.protein_offsets[i+1]):
+                d = {"name": s.name_vocab[s.dom_name[j]],
+                    "pos": (int(s.dom_start[j]), int(s.dom_end[j])),
+                    "db": s.db_vocab[s.dom_db[j]]}
+                if s.dom_fam[j] >= 0:
+                    d["fam"] = s.fam_vocab[s.dom_fam[j]]
+                domains.append(d)
+            return domains
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __contains__(self, key):
+        return key in self.keys_ or key in self.overrides
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self.keys_) + [k for k in self.overrides if k not in self.keys_]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def as_dict(self):
+        """
+        **Purpose**
+            Return a plain dict copy of this protein
+        """
+        return {k: self[k] for k in self.keys()}
+
+    def __repr__(self):
+        return '<record_view {0}>'.format(self["name"])
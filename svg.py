@@ -0,0 +1,84 @@
+"""
+
+A minimal SVG writer for the 'svg-native' backend of schematic.draw()
+
+Schematics are only rectangles and text, so they are written straight out
+as SVG elements, without going through matplotlib. Coordinates follow the
+same figure/axes layout as the matplotlib path, in points (1/72 inch).
+
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+from .layout import native_canvas, native_axes
+
+FONT_FAMILY = "DejaVu Sans, Bitstream Vera Sans, Arial, sans-serif" # matplotlib's default font first
+CHAR_WIDTH = 0.6 # approximate advance width of a DejaVu Sans character, as a fraction of the font size
+
+svg_va = {"center": "central", "top": "hanging", "bottom": "text-after-edge", "baseline": "auto"}
+svg_ha = {"center": "middle", "left": "start", "right": "end"}
+
+class svg_axes(native_axes):
+    def text_width(self, s, fontsize):
+        """
+        **Purpose**
+            Estimated width of s in x data units
+        """
+        return CHAR_WIDTH * fontsize * len(s) / self.w * (self.xlim[1] - self.xlim[0])
+
+    def text_height(self, fontsize):
+        """
+        **Purpose**
+            Height of a line of text in y data units
+        """
+        return fontsize / self.h * (self.ylim[1] - self.ylim[0])
+
+    def rect(self, x, y, width, height, fc, ec="none", lw=0, zorder=1):
+        """
+        **Purpose**
+            As ax.add_patch(Rectangle((x, y), width, height, ...))
+        """
+        x1, x2 = self.tx(x), self.tx(x + width)
+        y1, y2 = self.ty(y + height), self.ty(y)
+        if ec == "none":
+            stroke = ''
+        else:
+            stroke = ' stroke="{0}" stroke-width="{1:g}"'.format(ec, lw)
+        self.canvas.add(zorder, '<rect x="{0:.2f}" y="{1:.2f}" width="{2:.2f}" height="{3:.2f}" fill="{4}"{5}/>'.format(
+            min(x1, x2), min(y1, y2), abs(x2 - x1), abs(y2 - y1), fc, stroke))
+
+    def text(self, x, y, s, fontsize, color="black", ha="left", va="baseline", zorder=3):
+        """
+        **Purpose**
+            As ax.text(x, y, s, ...)
+        """
+        self.canvas.add(zorder, '<text x="{0:.2f}" y="{1:.2f}" font-size="{2:g}" fill="{3}" text-anchor="{4}" dominant-baseline="{5}">{6}</text>'.format(
+            self.tx(x), self.ty(y), fontsize, color, svg_ha[ha], svg_va[va], escape(str(s))))
+
+class svg_canvas(native_canvas):
+    axes_class = svg_axes
+
+    def __init__(self, figsize):
+        """
+        **Purpose**
+            An SVG figure of figsize inches
+        """
+        self.width = figsize[0] * 72.0
+        self.height = figsize[1] * 72.0
+        self.elements = [] # (zorder, n, <svg element>)
+
+    def add(self, zorder, element):
+        self.elements.append((zorder, len(self.elements), element))
+
+    def tostring(self):
+        out = ['<?xml version="1.0" encoding="utf-8" standalone="no"?>',
+            '<svg xmlns="http://www.w3.org/2000/svg" width="{0:g}pt" height="{1:g}pt" viewBox="0 0 {0:g} {1:g}" version="1.1">'.format(self.width, self.height),
+            '<rect x="0" y="0" width="{0:g}" height="{1:g}" fill="white"/>'.format(self.width, self.height),
+            '<g font-family={0}>'.format(quoteattr(FONT_FAMILY))]
+        out += [e[2] for e in sorted(self.elements)] # matplotlib also draws in zorder, then in the order added
+        out += ['</g>', '</svg>', '']
+        return '\n'.join(out)
+
+    def save(self, filename):
+        with open(filename, 'wt') as oh:
+            oh.write(self.tostring())
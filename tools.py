@@ -1,13 +1,14 @@
 
-import matplotlib.cm as cm
 import numpy
 
+from .fileio import open_domain_file
+
 def collate_family_defining(filename):
     """
     scan a filename and list all 'FAMILY-DEFINING' features
     """
     
-    oh = open(filename, "rU")
+    oh = open_domain_file(filename)
     
     doms = []
     for line in oh:
@@ -19,6 +20,7 @@ def collate_family_defining(filename):
     for d in set_of_doms:
         print("%s\t%s" % (doms.count(d), d))
     
+    import matplotlib.cm as cm
     cols = cm.Paired(numpy.arange(len(set_of_doms))/ (len(set_of_doms)*1.0))[:,:-1]
     print(cols)
     
@@ -28,7 +30,7 @@ def collate_family_defining(filename):
     print("Suggested ColourMap:")
     print("col_map = {")
     for i, d in enumerate(set_of_doms):
-        print("\t'%s': '%s'," % (d, '#%02x%02x%02x' % tuple(cols[i]*255)))
+        print("\t'%s': '%s'," % (d, '#%02x%02x%02x' % tuple(int(c) for c in cols[i]*255)))
     print("\t}")
     
     oh.close()
\ No newline at end of file